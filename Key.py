@@ -29,6 +29,16 @@ class Key:
         "Unknown": 3.0,
     }
 
+    # Keeps each Key small, there's one per slot in every layout a worker holds
+    __slots__ = (
+        "base",
+        "shift",
+        "is_immovable",
+        "location",
+        "is_immutable",
+        "frequency",
+    )
+
     def __init__(
         self,
         base,
@@ -55,10 +65,15 @@ class Key:
 
     def distance_from_home_row(self):
         """How many rows away from the homerow the key is"""
-        if self.location is None:
+        return self.row_distance_at(self.location)
+
+    @staticmethod
+    def row_distance_at(location):
+        """distance_from_home_row() of whatever key sits at location"""
+        if location is None:
             return 100
         home_row = 2
-        distance = home_row - self.location[1]
+        distance = home_row - location[1]
         return abs(distance)
 
     def euclidean_distance(self, other):
@@ -93,19 +108,29 @@ class Key:
 
     def get_finger(self):
         """Returns the key that should be used for typing it if touch typing."""
-        if self.location is None:
+        return self.finger_at(self.location)
+
+    @classmethod
+    def finger_at(cls, location):
+        """get_finger() of whatever key sits at location"""
+        if location is None:
             return None
-        for finger, (start, end) in self.FINGER_RANGES.items():
-            if start <= self.location[0] <= end:
+        for finger, (start, end) in cls.FINGER_RANGES.items():
+            if start <= location[0] <= end:
                 return finger
         return None
 
     def get_finger_cost(self):
         """Gets the finger for the key then the cost of typing with that finger"""
-        finger = self.get_finger()
+        return self.finger_cost_at(self.location)
+
+    @classmethod
+    def finger_cost_at(cls, location):
+        """get_finger_cost() of whatever key sits at location"""
+        finger = cls.finger_at(location)
         if finger is None:
-            return self.FINGER_COST["Unknown"]
-        return self.FINGER_COST[finger]
+            return cls.FINGER_COST["Unknown"]
+        return cls.FINGER_COST[finger]
 
     def score(self, HR_WEIGHT, FINGER_WEIGHT):
         """Returns the sum of finger expense and distance from homerow * the given weights"""
@@ -0,0 +1,292 @@
+from Key import Key
+import json
+from collections import Counter, defaultdict
+from corpus_stats import CorpusStats
+from incremental_scorer import moved_by_swap_keys, moved_by_swap_shifts
+from ngram_scoring import finger_id, trigram_cost_table, trigram_index
+
+
+def load_heatmap(heatmap):
+    """Effort per slot from a heatmap json (a path or already loaded), laid out like the
+    layout files but with an "effort" per key instead of characters: {(x, y): effort}"""
+    if not isinstance(heatmap, dict):
+        with open(heatmap, "r") as f:
+            heatmap = json.load(f)
+    return {
+        (key_data["x"], key_data["y"]): key_data["effort"]
+        for row in heatmap["layout"]
+        for key_data in row
+    }
+
+
+def slot_tables(slots, heatmap=None, movable=None):
+    """Everything that only depends on where a slot is, worked out once per slot since the
+    slots never move: {"fingers", "hands", "rows", "finger_costs", "effort"}, each a dict
+    of slot -> value (effort is None without a heatmap). The heatmap has to cover every
+    slot in movable (all of them by default), slots nothing can move to default to 0.
+    """
+    fingers = {loc: Key.finger_at(loc) for loc in slots}
+    effort = None
+    if heatmap is not None:
+        missing = [loc for loc in (slots if movable is None else movable) if loc not in heatmap]
+        if missing:
+            raise ValueError(f"Heatmap has no effort for slots {missing}")
+        effort = {loc: heatmap.get(loc, 0) for loc in slots}
+    hands = {loc: finger.split("_")[0] if finger else None for loc, finger in fingers.items()}
+    return {
+        "fingers": fingers,
+        "hands": hands,
+        "rows": {loc: Key.row_distance_at(loc) for loc in slots},
+        "finger_costs": {loc: Key.finger_cost_at(loc) for loc in slots},
+        "effort": effort,
+    }
+
+
+class KeyboardLayout:
+    def __init__(self, layout, corpus, heatmap=None):
+        """layout is a path to a layout json or the already loaded json
+        corpus is either the raw text or a CorpusStats that's already been counted,
+        pass the same CorpusStats to every layout so the corpus is only counted once
+        heatmap is an optional comfort heatmap (see load_heatmap), without one a key's
+        effort is guessed from its row and finger like Key.score() does"""
+        self.layout = {}
+        self.char_locations = {}  # base/shift character -> location, kept in sync by the swaps
+        if isinstance(layout, dict):
+            layout_json = layout
+        else:
+            with open(layout, "r") as f:
+                layout_json = json.load(f)
+        if isinstance(corpus, CorpusStats):
+            self.frequencies, self.bigrams = corpus.frequencies, corpus.bigrams
+            self.trigrams, self.skipgrams = corpus.trigrams, corpus.skipgrams
+        else:
+            self.frequencies, self.bigrams = self.generate_frequencies(corpus)
+            # Raw text only gets the bigram counts, count a CorpusStats with count_trigrams for these
+            self.trigrams, self.skipgrams = Counter(), Counter()
+        self.construct(layout_json)
+        self.index_slots(load_heatmap(heatmap) if heatmap is not None else None)
+
+    def get_key(self, location):
+        """Returns a key given it's location."""
+        return self.layout.get(location, None)
+
+    def get_location(self, key: str):
+        """Returns a location given either the base or shift."""
+        return self.char_locations.get(key, None)
+
+    def index_key(self, key: Key):
+        """Adds a key's characters to the character index, first key to claim a character keeps it"""
+        for char in (key.base, key.shift):
+            self.char_locations.setdefault(char, key.location)
+
+    def index_slots(self, heatmap=None):
+        """Everything that only depends on where a slot is, worked out once per slot since the
+        slots never move: finger, hand, distance from the home row, finger cost and effort
+        """
+        movable = [loc for loc, key in self.layout.items() if not key.is_immovable]
+        tables = slot_tables(list(self.layout), heatmap, movable)
+        self.slot_fingers = tables["fingers"]
+        self.slot_hands = tables["hands"]
+        self.slot_rows = tables["rows"]
+        self.slot_finger_costs = tables["finger_costs"]
+        self.slot_effort = tables["effort"]
+
+    def position_costs(self, home_row_weight=1, finger_weight=1, effort_weight=1):
+        """Cost of a keystroke in every slot: the heatmap effort * effort_weight if there's a
+        heatmap, otherwise the same row/finger cost as Key.score()"""
+        if self.slot_effort is not None:
+            return {loc: effort * effort_weight for loc, effort in self.slot_effort.items()}
+        return {
+            loc: self.slot_rows[loc] * home_row_weight
+            + self.slot_finger_costs[loc] * finger_weight
+            for loc in self.layout
+        }
+
+    def swap_keys(self, key1: Key, key2: Key):
+        """Swaps the locations of 2 keys in the layout
+        Silently fails if either key is immovable (shift, enter, backspace)
+        """
+        # Only the characters these keys actually own in the index move
+        moved = moved_by_swap_keys(self.char_locations, key1, key2)
+        if moved is None:
+            return
+
+        loc1 = key1.location
+        loc2 = key2.location
+
+        self.layout[loc1], self.layout[loc2] = self.layout[loc2], self.layout[loc1]
+
+        # Update key locations
+        key1.set_location(loc2)
+        key2.set_location(loc1)
+        self.char_locations.update(moved)
+
+    def evaluate_bigram_score(
+        self, same_finger_penalty=3.0, same_hand_penalty=1.5, bigrams=None
+    ):
+        """Complex scoring algorithm, scores the bigrams (combinations of 2 letters) from the dataset
+        Punishes using the same finger (a lot) and same hand(a little) being used in the bigram
+        bigrams defaults to the layout's own, the skipgrams are scored through here too
+        """
+        if bigrams is None:
+            bigrams = self.bigrams
+        total_score = 0
+        char_locations = self.char_locations
+        for bigram, freq in bigrams.items():
+            loc1 = char_locations.get(bigram[0])
+            loc2 = char_locations.get(bigram[1])
+
+            if loc1 and loc2:
+                # Old method
+                # base_cost = key1.euclidean_distance(key2)
+
+                penalty = 0
+                finger1 = self.slot_fingers[loc1]
+                finger2 = self.slot_fingers[loc2]
+
+                if finger1 and finger2:
+                    if finger1 == finger2:
+                        penalty = same_finger_penalty
+                    elif self.slot_hands[loc1] == self.slot_hands[loc2]:
+                        penalty = same_hand_penalty
+
+                total_score += penalty * freq
+
+        return total_score
+
+    def evaluate_skipgram_score(self, same_finger_penalty=3.0, same_hand_penalty=1.5):
+        """Same finger/same hand penalties as the bigrams but for the 1st and 3rd letter of every trigram"""
+        return self.evaluate_bigram_score(
+            same_finger_penalty, same_hand_penalty, self.skipgrams
+        )
+
+    def evaluate_trigram_score(self, trigram_penalties=None):
+        """Scores the trigrams by the kind of finger movement they take (rolls, redirects...),
+        see ngram_scoring.py for the kinds and what they cost"""
+        costs = trigram_cost_table(trigram_penalties)
+        total_score = 0
+        char_locations = self.char_locations
+        for trigram, freq in self.trigrams.items():
+            locs = [char_locations.get(char) for char in trigram]
+            if all(locs):
+                fingers = [finger_id(self.slot_fingers[loc]) for loc in locs]
+                total_score += costs[trigram_index(*fingers)] * freq
+        return total_score
+
+    def evaluate_total_score(
+        self,
+        home_row_weight=1,
+        finger_weight=1,
+        bigram_weight=1,
+        same_finger_penalty=3.0,
+        same_hand_penalty=1.5,
+        trigram_weight=0,
+        skipgram_weight=0,
+        trigram_penalties=None,
+        effort_weight=1,
+    ):
+        """Sums the scores from bigrams and the per slot key costs,
+        plus trigrams and skipgrams if they're weighted"""
+        total_score = 0
+        costs = self.position_costs(home_row_weight, finger_weight, effort_weight)
+        for loc, key in self.layout.items():
+            if key.frequency > 0:
+                total_score += costs[loc] * key.frequency
+        bigram_score = self.evaluate_bigram_score(
+            same_finger_penalty, same_hand_penalty
+        )
+        total_score += bigram_score * bigram_weight
+        if skipgram_weight:
+            total_score += skipgram_weight * self.evaluate_skipgram_score(
+                same_finger_penalty, same_hand_penalty
+            )
+        if trigram_weight:
+            total_score += trigram_weight * self.evaluate_trigram_score(trigram_penalties)
+
+        return total_score
+
+    def __str__(self):
+        return str(self.layout)
+
+    def construct(self, layout_json):
+        """Constructs a keyboard layout from a properly formed json file"""
+        for row in layout_json["layout"]:
+            for key_data in row:
+                if "name" in key_data:
+                    key = Key(
+                        base=key_data["name"],
+                        shift=key_data["name"],
+                        is_immutable=True,
+                        is_immovable=True,
+                        location=(key_data["x"], key_data["y"]),
+                        frequency=0,
+                    )
+                else:
+                    key = Key(
+                        base=key_data["base"],
+                        shift=key_data["shift"],
+                        is_immutable=(
+                            key_data["base"].isalpha() and key_data["shift"].isalpha()
+                        ),
+                        location=(key_data["x"], key_data["y"]),
+                        frequency=self.frequencies.get(key_data["base"].lower(), 0),
+                    )
+                self.layout[key.location] = key
+                self.index_key(key)
+        return self
+
+    def swap_shifts(self, key1: Key, key2: Key):
+        """Swaps only the shift layer for 2 keys
+        Silently fails if either key is immutable (letters),
+        either key is immovable, or either key doesn't change when shift is held"""
+        moved = moved_by_swap_shifts(self.char_locations, key1, key2)
+        if moved is None:
+            return
+
+        key1.shift, key2.shift = key2.shift, key1.shift
+        self.char_locations.update(moved)
+
+    def generate_frequencies(self, corpus):
+        """Given a corpus of text as a string, generates the bigram and single letter frequencies"""
+        stats = CorpusStats.from_text(corpus)
+        return stats.frequencies, stats.bigrams
+
+    def to_json(self):
+        """The layout in the same format as the json files it's loaded from"""
+        rows_dict = defaultdict(list)
+        for loc, key in self.layout.items():
+            if loc is None or not isinstance(loc, tuple) or len(loc) != 2:
+                print(f"Warning: Skipping key {key.base} with invalid location {loc}")
+                continue
+            x, y = loc
+            key_data = {
+                "base": key.base,
+                "shift": key.shift,
+                "x": x,
+                "y": y,
+            }
+            if key.is_immovable:
+                key_data = {"name": key.base, "x": x, "y": y}
+
+            rows_dict[y].append(key_data)
+
+        # Sort rows by y-coordinate
+        sorted_rows = sorted(rows_dict.items())
+
+        layout_json = {"layout": []}
+        for y, keys_in_row in sorted_rows:
+            sorted_keys_in_row = sorted(keys_in_row, key=lambda k: k["x"])
+            layout_json["layout"].append(sorted_keys_in_row)
+        return layout_json
+
+    def write_json(self, filename="output_layout.json"):
+        """Writes out a layout to a json file, for loading or visualizing"""
+        layout_json = self.to_json()
+        try:
+            with open(filename, "w") as f:
+                json.dump(layout_json, f, indent=4)
+            print(f"Layout successfully written to {filename}")
+        except IOError as e:
+            print(f"Error writing layout to {filename}: {e}")
+        except TypeError as e:
+            print(f"Error serializing layout data to JSON: {e}")
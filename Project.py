@@ -1,219 +1,89 @@
-from Key import Key
 import json
-from collections import Counter, defaultdict
 import random
-from layout_renderer import render_keyboard
-import matplotlib.pyplot as plt
 import math
-
-
-class KeyboardLayout:
-    def __init__(self, layout, corpus):
-        self.layout = {}
-        with open(layout, "r") as f:
-            layout_json = json.load(f)
-            self.frequencies, self.bigrams = self.generate_frequencies(corpus)
-            self.construct(layout_json)
-
-    def get_key(self, location):
-        """Returns a key given it's location."""
-        return self.layout.get(location, None)
-
-    def get_location(self, key: str):
-        """Returns a location given either the base or shift."""
-        for loc, k in self.layout.items():
-            if k.base == key or k.shift == key:
-                return loc
-        return None
-
-    def swap_keys(self, key1: Key, key2: Key):
-        """Swaps the locations of 2 keys in the layout
-        Silently fails if either key is immovable (shift, enter, backspace)
-        """
-        if key1.is_immovable or key2.is_immovable:
-            return
-
-        loc1 = key1.location
-        loc2 = key2.location
-
-        self.layout[loc1], self.layout[loc2] = self.layout[loc2], self.layout[loc1]
-
-        # Update key locations
-        key1.set_location(loc2)
-        key2.set_location(loc1)
-
-    def evaluate_bigram_score(self, same_finger_penalty=3.0, same_hand_penalty=1.5):
-        """Complex scoring algorithm, scores the bigrams (combinations of 2 letters) from the dataset
-        Punishes using the same finger (a lot) and same hand(a little) being used in the bigram
-        """
-        total_score = 0
-        for bigram, freq in self.bigrams.items():
-            loc1 = self.get_location(bigram[0])
-            loc2 = self.get_location(bigram[1])
-
-            if loc1 and loc2:
-                key1 = self.layout[loc1]
-                key2 = self.layout[loc2]
-
-                # Old method
-                # base_cost = key1.euclidean_distance(key2)
-
-                penalty = 0
-                finger1 = key1.get_finger()
-                finger2 = key2.get_finger()
-
-                if finger1 and finger2:
-                    if finger1 == finger2:
-                        penalty = same_finger_penalty
-                    else:
-                        hand1 = finger1.split("_")[0]
-                        hand2 = finger2.split("_")[0]
-                        if hand1 == hand2:
-                            penalty = same_hand_penalty
-
-                total_score += penalty * freq
-
-        return total_score
-
-    def evaluate_total_score(
-        self,
-        home_row_weight=1,
-        finger_weight=1,
-        bigram_weight=1,
-        same_finger_penalty=3.0,
-        same_hand_penalty=1.5,
-    ):
-        """Sums the scores from bigrams and the scoring function in key"""
-        total_score = 0
-        for key in self.layout.values():
-            if key.frequency > 0:
-                total_score += key.score(home_row_weight, finger_weight) * key.frequency
-        bigram_score = self.evaluate_bigram_score(
-            same_finger_penalty, same_hand_penalty
-        )
-        total_score += bigram_score * bigram_weight
-
-        return total_score
-
-    def __str__(self):
-        return str(self.layout)
-
-    def construct(self, layout_json):
-        """Constructs a keyboard layout from a properly formed json file"""
-        for row in layout_json["layout"]:
-            for key_data in row:
-                if "name" in key_data:
-                    key = Key(
-                        base=key_data["name"],
-                        shift=key_data["name"],
-                        is_immutable=True,
-                        is_immovable=True,
-                        location=(key_data["x"], key_data["y"]),
-                        frequency=0,
-                    )
-                else:
-                    key = Key(
-                        base=key_data["base"],
-                        shift=key_data["shift"],
-                        is_immutable=(
-                            key_data["base"].isalpha() and key_data["shift"].isalpha()
-                        ),
-                        location=(key_data["x"], key_data["y"]),
-                        frequency=self.frequencies.get(key_data["base"].lower(), 0),
-                    )
-                self.layout[key.location] = key
-        return self
-
-    def swap_shifts(self, key1: Key, key2: Key):
-        """Swaps only the shift layer for 2 keys
-        Silently fails if either key is immutable (letters),
-        either key is immovable, or either key doesn't change when shift is held"""
-        if key1.is_immutable or key2.is_immutable:
-            return
-        if key1.base == key1.shift or key2.base == key2.shift:
-            return
-        if key1.is_immovable or key2.is_immovable:
-            return
-
-        key1_shift = key1.shift
-        key2_shift = key2.shift
-
-        key1.shift = key2_shift
-        key2.shift = key1_shift
-
-    def generate_frequencies(self, corpus):
-        """Given a corpus of text as a string, generates the bigram and single letter frequencies"""
-        single_frequencies = Counter()
-        bigram_frequencies = Counter()
-        lines = corpus.splitlines()
-        for i in range(len(lines)):
-            line = lines[i]
-            for j in range(len(line) - 1):
-                bigram = (line[j].lower(), line[j + 1].lower())
-                bigram_frequencies[bigram] += 1
-        for line in corpus:
-            for char in line:
-                char = char.lower()
-                single_frequencies[char] += 1
-
-        return single_frequencies, bigram_frequencies
-
-    def write_json(self, filename="output_layout.json"):
-        """Writes out a layout to a json file, for loading or visualizing"""
-        rows_dict = defaultdict(list)
-        for loc, key in self.layout.items():
-            if loc is None or not isinstance(loc, tuple) or len(loc) != 2:
-                print(f"Warning: Skipping key {key.base} with invalid location {loc}")
-                continue
-            x, y = loc
-            key_data = {
-                "base": key.base,
-                "shift": key.shift,
-                "x": x,
-                "y": y,
-            }
-            if key.is_immovable:
-                key_data = {"name": key.base, "x": x, "y": y}
-
-            rows_dict[y].append(key_data)
-
-        # Sort rows by y-coordinate
-        sorted_rows = sorted(rows_dict.items())
-
-        layout_json = {"layout": []}
-        for y, keys_in_row in sorted_rows:
-            sorted_keys_in_row = sorted(keys_in_row, key=lambda k: k["x"])
-            layout_json["layout"].append(sorted_keys_in_row)
-
-        try:
-            with open(filename, "w") as f:
-                json.dump(layout_json, f, indent=4)
-            print(f"Layout successfully written to {filename}")
-        except IOError as e:
-            print(f"Error writing layout to {filename}: {e}")
-        except TypeError as e:
-            print(f"Error serializing layout data to JSON: {e}")
+from importlib.util import find_spec
+from KeyboardLayout import KeyboardLayout
+from incremental_scorer import IncrementalScorer
+from corpus_stats import load_corpus_stats, mix_corpus_stats
+from layout_state import LayoutState
+from checkpoint import (
+    Checkpointer,
+    random_state_from_json,
+    random_state_to_json,
+    read_checkpoint,
+)
+from ngram_scoring import TRIGRAM_PENALTIES
+from schedules import AdaptiveSchedule, BudgetSchedule, GeometricSchedule
+from telemetry import ScoreHistory
+from instrumentation import Progress, Timings
+from score_cache import CachedScorer, ScoreCache
+from moves import MoveGenerator
+from polish import polish
+from time import perf_counter
 
 
 ### Scoring Parameters
 home_row_weight = 1.0
 finger_weight = 1.0
 bigram_weight = 1.0
+trigram_weight = 0.0  # off by default, trigrams and skipgrams are only counted when weighted
+skipgram_weight = 0.0
+effort_weight = 1.0  # replaces home_row_weight and finger_weight when there's a heatmap
 
 # Multiplied by the weights to make each contribute equally
 # With each weight = 1 the score for Dvorak should be 30,000 +/- 5, Qwerty gets ~46,000; If not i've screwed up one of the scoring parameters
 home_row_balance_factor = 0.012034
 finger_balance_factor = 0.003825
 bigram_balance_factor = 0.007701
+# Not calibrated yet, the bigram factor is the right order of magnitude since these are counted the same way
+trigram_balance_factor = bigram_balance_factor
+skipgram_balance_factor = bigram_balance_factor
+# Puts heatmap.json's key costs roughly where the row/finger ones are (between Dvorak and Qwerty)
+effort_balance_factor = 0.0072
 
 # Penalties
 same_finger_penalty = 4.0
 same_hand_penalty = 1.5
+trigram_penalties = dict(TRIGRAM_PENALTIES)  # per kind of trigram, see ngram_scoring.py
+ngram_limit = 100_000  # most common trigrams/skipgrams kept, bounds memory on big corpora
 
 # Apply those balance factors from earlier
 home_row_weight *= home_row_balance_factor
 finger_weight *= finger_balance_factor
 bigram_weight *= bigram_balance_factor
+trigram_weight *= trigram_balance_factor
+skipgram_weight *= skipgram_balance_factor
+effort_weight *= effort_balance_factor
+
+
+def set_weights(
+    home_row=1.0,
+    finger=1.0,
+    bigram=1.0,
+    same_finger=4.0,
+    same_hand=1.5,
+    trigram=0.0,
+    skipgram=0.0,
+    effort=1.0,
+):
+    """Sets the scoring parameters above, the weights get the balance factors applied like they do up there"""
+    global home_row_weight, finger_weight, bigram_weight, trigram_weight, skipgram_weight
+    global effort_weight
+    global same_finger_penalty, same_hand_penalty
+    home_row_weight = home_row * home_row_balance_factor
+    finger_weight = finger * finger_balance_factor
+    bigram_weight = bigram * bigram_balance_factor
+    trigram_weight = trigram * trigram_balance_factor
+    skipgram_weight = skipgram * skipgram_balance_factor
+    effort_weight = effort * effort_balance_factor
+    same_finger_penalty = same_finger
+    same_hand_penalty = same_hand
+
+
+def uses_trigrams():
+    """Whether the corpus needs trigram/skipgram counts for the current weights"""
+    return bool(trigram_weight or skipgram_weight)
+
 
 ### Annealing Parameters
 temperature = (
@@ -224,61 +94,171 @@ cooling_rate = 0.995  # temperature is multiplied by this each iteration, 0.95-0
 iterations = math.ceil(
     math.log(1 / temperature) / math.log(cooling_rate)
 )  # calculate how many iterations it'll take
-print(f"Number of iterations: {iterations:.2f}")
 
 verbose = False  # Prints each swap made and the effect, very cool to look at but not useful and slow
-random.seed(1)
-corpus_file = "./Processed Corpi/corpusJava.txt"
-
-### Manual Testing the Score Function
-with open(corpus_file, "r") as f:
-    corpus = f.read()
-qwerty = KeyboardLayout("./qwerty.json", corpus)
-qwerty_score = qwerty.evaluate_total_score(
-    home_row_weight=home_row_weight,
-    finger_weight=finger_weight,
-    bigram_weight=bigram_weight,
-    same_finger_penalty=same_finger_penalty,
-    same_hand_penalty=same_hand_penalty,
-)
-print(f"Total Score (QWERTY): {qwerty_score:.2f}")
-dvorak = KeyboardLayout("./dvorak.json", corpus)
-dvorak_score = dvorak.evaluate_total_score(
-    home_row_weight=home_row_weight,
-    finger_weight=finger_weight,
-    bigram_weight=bigram_weight,
-    same_finger_penalty=same_finger_penalty,
-    same_hand_penalty=same_hand_penalty,
-)
-print(f"Total Score (Dvorak): {dvorak_score:.2f}")
-
-print(f"Dvorak Improvement: {(qwerty_score - dvorak_score) / qwerty_score * 100:.2f}%")
+corpus_file = "./Processed Corpi/corpusJava.txt"  # or a directory of source files, counted in parallel
+# Several corpora can be mixed with "path:weight", e.g. ["java.txt:0.6", "english.txt:0.3", "shell/:0.1"]
+heatmap_file = None  # comfort heatmap for key costs (e.g. "./heatmap.json"), None guesses from row and finger
+corpus_workers = None  # processes used to count a corpus directory, None uses every core
+use_numpy = find_spec("numpy") is not None  # numpy for full scores and polishing, same results as the python one
+
+# What a run can start from, anything else is treated as a path to a layout json
+STARTING_LAYOUTS = {
+    "dvorak": "./dvorak.json",
+    "qwerty": "./qwerty.json",
+}
+
+
+def parse_corpus_spec(spec):
+    """"path" or "path:weight" -> (path, weight)"""
+    path, _, weight = spec.rpartition(":")
+    if path:
+        try:
+            return path, float(weight)
+        except ValueError:
+            pass
+    return spec, 1.0
 
 
-def should_accept(new_score, current_score, temperature):
-    """Helper function, returns true if the new score is better or randomly based on how high the temperature is"""
-    return new_score < current_score or random.random() < math.exp(
-        (current_score - new_score) / temperature
+def load_corpora(specs, workers=None, ngram_limit=None):
+    """Loads every corpus in specs (see parse_corpus_spec) once, through the stats cache,
+    and mixes them into one weighted table so annealing costs the same however many there are.
+    Returns the mixed CorpusStats and [(path, weight, CorpusStats), ...] for reporting.
+    """
+    corpora = []
+    for spec in specs:
+        path, weight = parse_corpus_spec(spec)
+        stats = load_corpus_stats(
+            path, workers=workers, count_trigrams=uses_trigrams(), ngram_limit=ngram_limit
+        )  # counted once, cached in ./.corpus_cache
+        corpora.append((path, weight, stats))
+    mixed = mix_corpus_stats([(stats, weight) for _, weight, stats in corpora])
+    return mixed, corpora
+
+
+def report_corpora(corpora, layouts, heatmap=None):
+    """Prints how each layout scores against each corpus on its own
+    layouts maps a name to anything KeyboardLayout takes as a layout"""
+    for path, weight, stats in corpora:
+        scores = [
+            f"{name}: {score(KeyboardLayout(layout, stats, heatmap)):.2f}"
+            for name, layout in layouts.items()
+        ]
+        print(f"{path} (weight {weight:g}) | " + " | ".join(scores))
+
+
+def make_scorer(layout: KeyboardLayout, batch=False):
+    """Builds the incremental scorer with the weights above. One move at a time (annealing)
+    the python one is fastest, batch=True gives the numpy one (if use_numpy) for full
+    scores and for scoring whole neighbourhoods at once (polish)"""
+    if batch and use_numpy:
+        # Imported here so importing this module doesn't pull in numpy
+        from vectorized_scorer import VectorizedScorer as scorer_class
+    else:
+        scorer_class = IncrementalScorer
+    return scorer_class(
+        layout,
+        home_row_weight=home_row_weight,
+        finger_weight=finger_weight,
+        bigram_weight=bigram_weight,
+        same_finger_penalty=same_finger_penalty,
+        same_hand_penalty=same_hand_penalty,
+        trigram_weight=trigram_weight,
+        skipgram_weight=skipgram_weight,
+        trigram_penalties=trigram_penalties,
+        effort_weight=effort_weight,
     )
 
 
 def score(layout: KeyboardLayout):
     """Wrapper for this 7 line function call"""
+    if use_numpy:
+        return make_scorer(layout, batch=True).score
     return layout.evaluate_total_score(
         home_row_weight=home_row_weight,
         finger_weight=finger_weight,
         bigram_weight=bigram_weight,
         same_finger_penalty=same_finger_penalty,
         same_hand_penalty=same_hand_penalty,
+        trigram_weight=trigram_weight,
+        skipgram_weight=skipgram_weight,
+        trigram_penalties=trigram_penalties,
+        effort_weight=effort_weight,
+    )
+
+
+def should_accept(new_score, current_score, temperature):
+    """Helper function, returns true if the new score is better or randomly based on how high the temperature is"""
+    return new_score < current_score or random.random() < math.exp(
+        (current_score - new_score) / temperature
     )
 
 
+def propose_move(scorer, moves):
+    """Picks 2 keys and whether to swap them or their shift layer with a moves.MoveGenerator
+    Returns the keys and the scorer's delta and apply methods for that kind of swap
+    """
+    key1, key2, shifts = moves.propose()
+    if shifts:
+        return key1, key2, scorer.delta_swap_shifts, scorer.apply_swap_shifts
+    return key1, key2, scorer.delta_swap_keys, scorer.apply_swap_keys
+
+
+def metropolis_step(scorer, moves, temperature):
+    """Proposes one random swap and accepts or rejects it at the given temperature
+    The layout is only changed if the swap is accepted, only the change in score is computed otherwise
+    Returns whether it was accepted, the 2 keys and the score the swap would give
+    """
+    key1, key2, delta_swap, apply_swap = propose_move(scorer, moves)
+    current_score = scorer.score
+    new_score = current_score + delta_swap(key1, key2)
+    accepted = should_accept(new_score, current_score, temperature)
+    if accepted:
+        apply_swap(key1, key2)
+    return accepted, key1, key2, new_score
+
+
+def timed_metropolis_step(scorer, moves, temperature, timings):
+    """metropolis_step() that adds the time each part takes to an instrumentation.Timings
+    Time between the end of the last step and the start of this one counts as bookkeeping
+    """
+    started = perf_counter()
+    if timings.step_finished is not None:
+        timings.bookkeeping += started - timings.step_finished
+    key1, key2, delta_swap, apply_swap = propose_move(scorer, moves)
+    proposed = perf_counter()
+    current_score = scorer.score
+    new_score = current_score + delta_swap(key1, key2)
+    scored = perf_counter()
+    accepted = should_accept(new_score, current_score, temperature)
+    decided = perf_counter()
+    if accepted:
+        apply_swap(key1, key2)
+    finished = perf_counter()
+    timings.move_generation += proposed - started
+    timings.scoring += (scored - proposed) + (finished - decided)
+    timings.acceptance += decided - scored
+    timings.step_finished = finished
+    timings.iterations += 1
+    return accepted, key1, key2, new_score
+
+
 def anneal(
     temperature,
     cooling_rate,
     starting_layout,
     allow_shift_layer_swaps=False,
     verbose=False,
+    reference_score=None,
+    show_progress=True,
+    schedule=None,
+    checkpointer=None,
+    resume=None,
+    history=None,
+    timings=None,
+    progress_interval=0.25,
+    score_cache=None,
+    move_weighting=None,
 ):
     """Main loop
     Score
@@ -286,118 +266,427 @@ def anneal(
     Score
     ...
     Less likely to accept changes that decrease score as temperature goes down
+    reference_score is what the improvement is measured against (usually qwerty), None skips it
+    schedule is any schedule from schedules.py, by default temperature is multiplied by cooling_rate until it hits 1
+    checkpointer is a checkpoint.Checkpointer the run's state is saved through now and then,
+    resume is a state read back with checkpoint.read_checkpoint to carry on from (same
+    starting layout, corpus and settings), which continues exactly like the original run would have
+    history is a telemetry.ScoreHistory to record into (a default one is made otherwise),
+    it's returned in place of a list of every score
+    timings is an instrumentation.Timings to add the time spent in each part of an iteration to
+    progress_interval is the least number of seconds between redrawing the progress bar
+    score_cache is a score_cache.ScoreCache to look proposed layouts up in before scoring them
+    move_weighting="frequency" proposes swaps of common characters more often, see moves.MoveGenerator
     """
-    scores_over_time = []
+    if schedule is None:
+        schedule = GeometricSchedule(temperature, cooling_rate)
+    if history is None:
+        history = ScoreHistory()
     top10_changes = []
-    current_score = score(starting_layout)
-    best_layout = starting_layout
-    best_score = current_score
-
     iteration_count = 0
+    moves = MoveGenerator(starting_layout, allow_shift_layer_swaps, move_weighting)
+    # Characters in the order the layout first indexed them, the numpy scorer sums in this order
+    char_order = list(starting_layout.char_locations)
+
+    if resume is None:
+        scorer = make_scorer(starting_layout)
+        best_score = scorer.score
+        # starting_layout keeps changing, so the best layout is kept as a compact snapshot
+        best_state = LayoutState.from_layout(starting_layout)
+        schedule.start(scorer, moves)
+    else:
+        LayoutState.from_json(resume["layout"]).apply_to(starting_layout)
+        char_locations = starting_layout.char_locations
+        reordered = {char: char_locations[char] for char in resume["char_order"]}
+        char_locations.clear()
+        char_locations.update(reordered)
+        scorer = make_scorer(starting_layout)
+        # The score is a running total, recomputing it could differ in the last digit
+        scorer.score = resume["score"]
+        best_score = resume["best_score"]
+        best_state = LayoutState.from_json(resume["best_layout"])
+        schedule.restore(resume["schedule"])
+        iteration_count = resume["iteration"]
+        history.restore(resume["history"])
+        keys_by_base = {key.base: key for key in starting_layout.layout.values()}
+        top10_changes = [
+            (keys_by_base[base1], keys_by_base[base2], improvement)
+            for base1, base2, improvement in resume["top10_changes"]
+        ]
+        random.setstate(random_state_from_json(resume["random_state"]))
+    if score_cache is not None:
+        scorer = CachedScorer(scorer, score_cache)
+    current_score = scorer.score
+    progress = Progress(progress_interval, timings) if show_progress else None
+
+    try:
+        while not schedule.done():
+            temperature = schedule.temperature
+            if timings is None:
+                accepted, key1, key2, new_score = metropolis_step(scorer, moves, temperature)
+            else:
+                accepted, key1, key2, new_score = timed_metropolis_step(
+                    scorer, moves, temperature, timings
+                )
 
-    while temperature > 1:
-        locations = list(starting_layout.layout.keys())
-        loc1, loc2 = random.sample(locations, 2)
-        key1 = starting_layout.layout[loc1]
-        key2 = starting_layout.layout[loc2]
+            improvement = (current_score - new_score) / current_score * 100
+            improved = False
 
-        did_shift_swap = False
+            if accepted:
+                if verbose:
+                    print(
+                        f"Accepted | Swapping {key1.base} and {key2.base} | Improvement: {improvement:.2f}%"
+                    )
+                current_score = scorer.score
+                improved = current_score < best_score
+                if improved:
+                    best_score = current_score
+                    best_state.capture(starting_layout)
+                    # filling in the top 10 changes we made, comment at the bottom of file as to why this is unused
+                    if len(top10_changes) < 10:
+                        top10_changes.append((key1, key2, improvement))
+                    else:
+                        min_improvement = min(top10_changes, key=lambda x: x[2])[2]
+                        if improvement > min_improvement:
+                            top10_changes.remove(min(top10_changes, key=lambda x: x[2]))
+                            top10_changes.append((key1, key2, improvement))
+            else:
+                if verbose:
+                    print(
+                        f"Declined | Swapping {key1.base} and {key2.base} | Improvement: {improvement:.2f}%"
+                    )
 
-        if random.random() < 0.5 and allow_shift_layer_swaps:
-            starting_layout.swap_shifts(key1, key2)
-            did_shift_swap = True
-        else:
-            starting_layout.swap_keys(key1, key2)
+            history.record(current_score, temperature, accepted)
+
+            # Cool down the temperature
+            schedule.update(accepted, improved)
+            temperature = schedule.temperature
+
+            iteration_count += 1
+            if progress is not None:
+                progress.update(iteration_count, schedule, current_score)
+
+            if checkpointer is not None and checkpointer.due(iteration_count):
+                checkpointer.save(
+                    {
+                        "iteration": iteration_count,
+                        "score": scorer.score,
+                        "best_score": best_score,
+                        "layout": LayoutState.from_layout(starting_layout).to_json(),
+                        "best_layout": best_state.to_json(),
+                        "char_order": char_order,
+                        "schedule": schedule.state(),
+                        "random_state": random_state_to_json(random.getstate()),
+                        "history": history.to_json(),
+                        "top10_changes": [
+                            (key1.base, key2.base, improvement)
+                            for key1, key2, improvement in top10_changes
+                        ],
+                    }
+                )
+    finally:
+        if progress is not None:
+            progress.finish(iteration_count, schedule, current_score)
+        history.finish(scorer.score, schedule.temperature)
+        if checkpointer is not None:
+            checkpointer.close()
 
-        new_score = score(starting_layout)
+    # Hand back the layout in its best state rather than wherever the chain ended up
+    best_layout = best_state.apply_to(starting_layout)
 
-        improvement = (current_score - new_score) / current_score * 100
+    qwerty_improvement = None
+    if reference_score:
+        qwerty_improvement = (reference_score - best_score) / reference_score * 100
 
-        if should_accept(new_score, current_score, temperature):
-            if verbose:
-                print(
-                    f"Accepted | Swapping {key1.base} and {key2.base} | Improvement: {improvement:.2f}%"
-                )
-            current_score = new_score
-            if current_score < best_score:
-                best_score = current_score
-                best_layout = starting_layout
-                # filling in the top 10 changes we made, comment at the bottom of file as to why this is unused
-                if len(top10_changes) < 10:
-                    top10_changes.append((key1, key2, improvement))
-                else:
-                    min_improvement = min(top10_changes, key=lambda x: x[2])[2]
-                    if improvement > min_improvement:
-                        top10_changes.remove(min(top10_changes, key=lambda x: x[2]))
-                        top10_changes.append((key1, key2, improvement))
-            scores_over_time.append(1 / new_score)
-        else:
-            if verbose:
-                print(
-                    f"Declined | Swapping {key1.base} and {key2.base} | Improvement: {improvement:.2f}%"
-                )
-            if did_shift_swap:
-                starting_layout.swap_shifts(key1, key2)
-            else:
-                starting_layout.swap_keys(key1, key2)
+    return best_layout, best_score, qwerty_improvement, history, top10_changes
 
-        # Cool down the temperature
-        temperature *= cooling_rate
 
-        iteration_count += 1
-        percentage_done = iteration_count / iterations * 100
-        if iteration_count % 50:
-            # Print progress bar
-            bar_length = 50
-            filled_length = int(bar_length * percentage_done / 100)
-            bar = "=" * filled_length + "-" * (bar_length - filled_length)
-            print(
-                f"\rProgress: [{bar}] {percentage_done:.2f}% | Temperature: {temperature:.2f}",
-                end="",
-            )
+def plot_scores(history, qwerty_score, dvorak_score, filename=None):
+    """Score^-1 over time against the QWERTY and Dvorak lines, shown in a window or saved to filename
+    history is the ScoreHistory from anneal(), the shaded band is the best/worst score in each point
+    """
+    import matplotlib.pyplot as plt  # slow to import, only needed here
+
+    iterations = history.series("iteration")
+    plt.title("Score^-1 over Time (Higher is Better)")
+    plt.plot(iterations, [1 / score for score in history.series("score")])
+    plt.fill_between(
+        iterations,
+        [1 / score for score in history.series("max_score")],
+        [1 / score for score in history.series("min_score")],
+        alpha=0.3,
+    )
+    plt.axhline(
+        y=1 / qwerty_score,
+        color="r",
+        linestyle="--",
+        label=f"QWERTY (1/{qwerty_score:.2f})",
+    )
+    plt.axhline(
+        y=1 / dvorak_score,
+        color="g",
+        linestyle="--",
+        label=f"Dvorak (1/{dvorak_score:.2f})",
+    )
+    plt.xlabel("Iteration")
+    plt.ylabel("Score^-1")
+    plt.legend()
+    if filename:
+        plt.savefig(filename)
+    else:
+        plt.show()
+
+
+def build_schedule(args):
+    """The schedule picked on the command line"""
+    options = dict(
+        seconds=args.seconds,
+        evaluations=args.evaluations,
+        reheat_after=args.reheat_after,
+        stop_after=args.stop_after,
+    )
+    if args.schedule == "budget":
+        return BudgetSchedule(args.temperature, **options)
+    if args.schedule == "adaptive":
+        return AdaptiveSchedule(args.temperature, **options)
+    return GeometricSchedule(
+        args.temperature if args.temperature is not None else temperature,
+        args.cooling_rate,
+        **options,
+    )
 
-    qwerty_improvement = (qwerty_score - best_score) / qwerty_score * 100
 
-    return best_layout, best_score, qwerty_improvement, scores_over_time, top10_changes
+def parse_args(argv=None):
+    import argparse
 
+    parser = argparse.ArgumentParser(
+        description="Anneal a keyboard layout against a corpus"
+    )
+    parser.add_argument(
+        "--corpus",
+        nargs="+",
+        default=[corpus_file],
+        help="text file or a directory of source files, several are mixed with path:weight",
+    )
+    parser.add_argument("--corpus-workers", type=int, default=corpus_workers)
+    parser.add_argument(
+        "--start", default="dvorak", help="dvorak, qwerty or a path to a layout json"
+    )
+    parser.add_argument("--output", default="best_annealed_layout.json")
+
+    weights = parser.add_argument_group("weights", "balance factors are applied on top of these")
+    weights.add_argument("--home-row-weight", type=float, default=1.0)
+    weights.add_argument("--finger-weight", type=float, default=1.0)
+    weights.add_argument("--bigram-weight", type=float, default=1.0)
+    weights.add_argument("--same-finger-penalty", type=float, default=4.0)
+    weights.add_argument("--same-hand-penalty", type=float, default=1.5)
+    weights.add_argument(
+        "--heatmap",
+        default=heatmap_file,
+        help="comfort heatmap json (like heatmap.json), replaces the row/finger key costs",
+    )
+    weights.add_argument(
+        "--effort-weight", type=float, default=1.0, help="key cost weight with --heatmap"
+    )
+    weights.add_argument(
+        "--trigram-weight", type=float, default=0.0, help="rolls, redirects and one hand trigrams"
+    )
+    weights.add_argument(
+        "--skipgram-weight", type=float, default=0.0, help="same finger/hand on letters 1 and 3"
+    )
+    weights.add_argument(
+        "--ngram-limit",
+        type=int,
+        default=ngram_limit,
+        help="most common trigrams/skipgrams kept, 0 keeps them all",
+    )
 
-random.seed(400)
+    annealing = parser.add_argument_group("schedule")
+    annealing.add_argument(
+        "--schedule", choices=["geometric", "budget", "adaptive"], default="geometric"
+    )
+    annealing.add_argument(
+        "--temperature",
+        type=float,
+        default=None,
+        help="starting temperature, left out it's 2**40 - 1 for geometric and estimated otherwise",
+    )
+    annealing.add_argument("--cooling-rate", type=float, default=cooling_rate)
+    annealing.add_argument("--seconds", type=float, default=None, help="wall-clock budget")
+    annealing.add_argument("--evaluations", type=int, default=None, help="evaluation budget")
+    annealing.add_argument("--reheat-after", type=int, default=None)
+    annealing.add_argument("--stop-after", type=int, default=None)
+    annealing.add_argument("--seed", type=int, default=400)
+    annealing.add_argument(
+        "--no-shift-swaps", action="store_true", help="only swap whole keys"
+    )
+    annealing.add_argument(
+        "--move-weighting",
+        choices=["uniform", "frequency"],
+        default="uniform",
+        help="frequency proposes swaps of common characters more often",
+    )
+    annealing.add_argument(
+        "--polish",
+        choices=["off", "swaps", "cycles"],
+        default="swaps",
+        help="steepest descent over every swap (and 3-cycle) once annealing is done",
+    )
 
-best_layout, best_score, improvement, scores_over_time, top10_changes = anneal(
-    temperature, cooling_rate, dvorak, True
-)
-print(f"Best Layout Score: {best_score:.2f}")
-print(f"Best Layout Improvement over qwerty: {improvement:.2f}%")
-best_layout.write_json("best_annealed_layout.json")
-
-with open("best_annealed_layout.json", "r") as f:
-    keyboard_layout_json = f.read()
-keyboard_layout = json.loads(keyboard_layout_json)
-render_keyboard(keyboard_layout)
-
-### This isn't the best changes compared to qwerty, but compared to the previous state
-### So it's acually not super useful
-# print("TOP 10 CHANGES:")
-# top10_changes.sort(key=lambda x: x[2], reverse=True)
-# for change in top10_changes:
-#     key1, key2, improvement = change
-#     print(f"Swapped {key1.base} and {key2.base} | Improvement: {improvement:.2f}%")
-
-plt.title("Score^-1 over Time (Higher is Better)")
-plt.plot(scores_over_time)
-plt.axhline(
-    y=1 / qwerty_score,
-    color="r",
-    linestyle="--",
-    label=f"QWERTY (1/{qwerty_score:.2f})",
-)
-plt.axhline(
-    y=1 / dvorak_score,
-    color="g",
-    linestyle="--",
-    label=f"Dvorak (1/{dvorak_score:.2f})",
-)
-plt.xlabel("Iteration")
-plt.ylabel("Score^-1")
-plt.legend()
-plt.show()
+    checkpoints = parser.add_argument_group("checkpoints")
+    checkpoints.add_argument(
+        "--checkpoint",
+        default=None,
+        help="save the run's state here every --checkpoint-every seconds",
+    )
+    checkpoints.add_argument("--checkpoint-every", type=float, default=300.0)
+    checkpoints.add_argument(
+        "--resume",
+        default=None,
+        help="carry on from a checkpoint, run with the same options as the original run",
+    )
+
+    parser.add_argument(
+        "--history",
+        default=None,
+        help="stream the downsampled score history to this .csv or .jsonl file",
+    )
+    parser.add_argument(
+        "--history-points", type=int, default=2000, help="most points the score history keeps"
+    )
+    parser.add_argument(
+        "--score-cache",
+        type=float,
+        default=0,
+        metavar="MB",
+        help="cache scores of visited layouts in up to this many megabytes, 0 turns it off",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="time move generation, scoring, acceptance and bookkeeping and print where the time went",
+    )
+    parser.add_argument(
+        "--progress-interval", type=float, default=0.25, help="seconds between progress bar updates"
+    )
+    parser.add_argument("--verbose", action="store_true", default=verbose)
+    parser.add_argument("--no-plot", action="store_true", help="skip the matplotlib plot")
+    parser.add_argument("--plot-file", default=None, help="save the plot instead of showing it")
+    args = parser.parse_args(argv)
+    if args.schedule == "budget" and not (args.seconds or args.evaluations):
+        parser.error("--schedule budget needs --seconds or --evaluations")
+    return args
+
+
+def main(argv=None):
+    from layout_renderer import render_keyboard
+
+    args = parse_args(argv)
+    set_weights(
+        args.home_row_weight,
+        args.finger_weight,
+        args.bigram_weight,
+        args.same_finger_penalty,
+        args.same_hand_penalty,
+        args.trigram_weight,
+        args.skipgram_weight,
+        args.effort_weight,
+    )
+    schedule = build_schedule(args)
+    if isinstance(schedule, GeometricSchedule) and not (args.seconds or args.evaluations):
+        print(f"Number of iterations: {schedule.iterations():.2f}")
+
+    ### Manual Testing the Score Function
+    corpus, corpora = load_corpora(args.corpus, args.corpus_workers, args.ngram_limit or None)
+    qwerty = KeyboardLayout("./qwerty.json", corpus, args.heatmap)
+    qwerty_score = score(qwerty)
+    print(f"Total Score (QWERTY): {qwerty_score:.2f}")
+    dvorak = KeyboardLayout("./dvorak.json", corpus, args.heatmap)
+    dvorak_score = score(dvorak)
+    print(f"Total Score (Dvorak): {dvorak_score:.2f}")
+
+    print(f"Dvorak Improvement: {(qwerty_score - dvorak_score) / qwerty_score * 100:.2f}%")
+
+    if args.start == "dvorak":
+        starting_layout = dvorak
+    else:
+        starting_layout = KeyboardLayout(
+            STARTING_LAYOUTS.get(args.start, args.start), corpus, args.heatmap
+        )
+
+    random.seed(args.seed)
+
+    resume = None
+    if args.resume:
+        resume = read_checkpoint(args.resume)
+        print(f"Resuming from {args.resume} at iteration {resume['iteration']}")
+    checkpointer = None
+    checkpoint_path = args.checkpoint or args.resume  # a resumed run keeps saving to the same file
+    if checkpoint_path:
+        checkpointer = Checkpointer(checkpoint_path, args.checkpoint_every)
+
+    history = ScoreHistory(args.history_points, stream=args.history)
+    timings = Timings() if args.profile else None
+    score_cache = ScoreCache(args.score_cache) if args.score_cache else None
+    best_layout, best_score, improvement, history, top10_changes = anneal(
+        None,
+        None,
+        starting_layout,
+        not args.no_shift_swaps,
+        verbose=args.verbose,
+        reference_score=qwerty_score,
+        schedule=schedule,
+        checkpointer=checkpointer,
+        resume=resume,
+        history=history,
+        timings=timings,
+        progress_interval=args.progress_interval,
+        score_cache=score_cache,
+        move_weighting=args.move_weighting,
+    )
+    if args.polish != "off":
+        polish_scorer = make_scorer(best_layout, batch=True)
+        polished = polish(
+            polish_scorer,
+            MoveGenerator(best_layout, not args.no_shift_swaps),
+            cycles=args.polish == "cycles",
+        )
+        best_score = polish_scorer.score
+        improvement = (qwerty_score - best_score) / qwerty_score * 100
+        print(
+            f"Polish: {polished['starting_score']:.2f} -> {polished['score']:.2f} "
+            f"({polished['improvement']:.3f}% better, {polished['moves']} moves)"
+        )
+    print(f"Best Layout Score: {best_score:.2f}")
+    print(f"Best Layout Improvement over qwerty: {improvement:.2f}%")
+    if len(corpora) > 1:
+        report_corpora(
+            corpora,
+            {"Best": best_layout.to_json(), "QWERTY": "./qwerty.json", "Dvorak": "./dvorak.json"},
+            args.heatmap,
+        )
+    if timings is not None:
+        print(timings.report())
+    if score_cache is not None:
+        print(score_cache.report())
+    best_layout.write_json(args.output)
+
+    with open(args.output, "r") as f:
+        keyboard_layout_json = f.read()
+    keyboard_layout = json.loads(keyboard_layout_json)
+    render_keyboard(keyboard_layout)
+
+    ### This isn't the best changes compared to qwerty, but compared to the previous state
+    ### So it's acually not super useful
+    # print("TOP 10 CHANGES:")
+    # top10_changes.sort(key=lambda x: x[2], reverse=True)
+    # for change in top10_changes:
+    #     key1, key2, improvement = change
+    #     print(f"Swapped {key1.base} and {key2.base} | Improvement: {improvement:.2f}%")
+
+    if not args.no_plot:
+        plot_scores(history, qwerty_score, dvorak_score, args.plot_file)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+import argparse
+import json
+
+import numpy as np
+from KeyboardLayout import KeyboardLayout, load_heatmap, slot_tables
+from layout_state import LayoutState
+from ngram_scoring import FINGER_COUNT, NO_FINGER, finger_id, trigram_cost_table
+from vectorized_scorer import penalty_matrix
+
+# Score components, in the order score_permutations returns them
+COMPONENTS = ("home_row", "finger", "effort", "bigram", "skipgram", "trigram")
+# Most layouts x trigrams scored at once, the trigram term needs a few times this many
+# 8 byte values in temporaries so it's scored in chunks of layouts
+TRIGRAM_CHUNK_SIZE = 1 << 21
+
+
+class BatchScorer:
+    """Scores many layouts against one set of corpus statistics in a single numpy pass.
+
+    Every layout becomes a row of char_slots (which slot each character sits in, the same
+    representation VectorizedScorer uses) plus a row of per-character key frequencies, and
+    the whole batch is scored with a few gathers. The corpus is never counted again, the
+    tables are built once from the CorpusStats.
+
+    Layouts can be layout json paths, loaded layout jsons, KeyboardLayouts or LayoutStates.
+    Characters and slots are the union over every layout given to the constructor, a
+    character a layout doesn't have goes to an extra "off the keyboard" slot that costs nothing.
+    """
+
+    def __init__(
+        self,
+        corpus,
+        layouts,
+        home_row_weight=1,
+        finger_weight=1,
+        bigram_weight=1,
+        same_finger_penalty=3.0,
+        same_hand_penalty=1.5,
+        trigram_weight=0,
+        skipgram_weight=0,
+        trigram_penalties=None,
+        effort_weight=1,
+        heatmap=None,
+    ):
+        self.corpus = corpus
+        self.weights = {
+            "home_row": home_row_weight,
+            "finger": finger_weight,
+            "effort": effort_weight,
+            "bigram": bigram_weight,
+            "skipgram": skipgram_weight,
+            "trigram": trigram_weight,
+        }
+        states = [self.to_state(layout) for layout in layouts]
+
+        self.slots = []
+        self.slot_index = {}
+        self.chars = []
+        self.char_ids = {}
+        movable = set()
+        for state in states:
+            for loc, immovable in zip(state.slots, state.immovable):
+                if loc not in self.slot_index:
+                    self.slot_index[loc] = len(self.slots)
+                    self.slots.append(loc)
+                if not immovable:
+                    movable.add(loc)
+            for char in state.chars:
+                if char not in self.char_ids:
+                    self.char_ids[char] = len(self.chars)
+                    self.chars.append(char)
+        self.off_keyboard = len(self.slots)
+
+        # Per slot tables, with one extra entry at the end for the off the keyboard slot
+        tables = slot_tables(
+            self.slots,
+            load_heatmap(heatmap) if heatmap is not None else None,
+            [loc for loc in self.slots if loc in movable],
+        )
+
+        def per_slot(name, off_keyboard):
+            return [tables[name][loc] for loc in self.slots] + [off_keyboard]
+
+        self.rows = np.array(per_slot("rows", 0), dtype=np.float64)
+        self.finger_costs = np.array(per_slot("finger_costs", 0), dtype=np.float64)
+        self.effort = None
+        if tables["effort"] is not None:
+            self.effort = np.array(per_slot("effort", 0), dtype=np.float64)
+        fingers = per_slot("fingers", None)
+        self.finger_ids = np.array([finger_id(finger) for finger in fingers], dtype=np.intp)
+        self.finger_ids[-1] = NO_FINGER
+        self.penalties = penalty_matrix(
+            fingers, per_slot("hands", None), same_finger_penalty, same_hand_penalty
+        )
+
+        # Corpus tables, sparse: only n-grams made of characters some layout has
+        self.bigram_chars, self.bigram_counts = self.ngram_arrays(corpus.bigrams, 2)
+        self.skipgram_chars, self.skipgram_counts = self.ngram_arrays(
+            corpus.skipgrams if skipgram_weight else {}, 2
+        )
+        self.trigram_chars, self.trigram_counts = self.ngram_arrays(
+            corpus.trigrams if trigram_weight else {}, 3
+        )
+        self.trigram_costs = np.array(trigram_cost_table(trigram_penalties), dtype=np.float64)
+
+        self.names = [self.name(layout, i) for i, layout in enumerate(layouts)]
+        self.char_slots, self.frequencies = self.permutations(states)
+
+    @staticmethod
+    def to_state(layout):
+        if isinstance(layout, LayoutState):
+            return layout
+        if isinstance(layout, KeyboardLayout):
+            return LayoutState.from_layout(layout)
+        if not isinstance(layout, dict):
+            with open(layout, "r") as f:
+                layout = json.load(f)
+        return LayoutState.from_json(layout)
+
+    @staticmethod
+    def name(layout, i):
+        return layout if isinstance(layout, str) else f"layout {i}"
+
+    def ngram_arrays(self, ngrams, n):
+        char_ids = self.char_ids
+        rows = []
+        counts = []
+        for ngram, count in ngrams.items():
+            if all(char in char_ids for char in ngram):
+                rows.append([char_ids[char] for char in ngram])
+                counts.append(count)
+        return (
+            np.array(rows, dtype=np.intp).reshape(-1, n),
+            np.array(counts, dtype=np.float64),
+        )
+
+    def permutation(self, layout):
+        """char_slots and key frequencies of one layout, like KeyboardLayout would index it:
+        the first key to claim a character keeps it, only a key's base character is typed
+        as that key (with its lowercase frequency)"""
+        state = self.to_state(layout)
+        char_slots = np.full(len(self.chars), self.off_keyboard, dtype=np.intp)
+        frequencies = np.zeros(len(self.chars), dtype=np.float64)
+        claimed = set()
+        for i, loc in enumerate(state.slots):
+            base = state.chars[state.base[i]]
+            shift = state.chars[state.shift[i]]
+            for char in (base, shift):
+                if char not in claimed:
+                    claimed.add(char)
+                    char_slots[self.char_ids[char]] = self.slot_index[loc]
+            owns_base = char_slots[self.char_ids[base]] == self.slot_index[loc]
+            if not state.immovable[i] and owns_base:
+                frequencies[self.char_ids[base]] = self.corpus.frequencies.get(base.lower(), 0)
+        return char_slots, frequencies
+
+    def permutations(self, layouts):
+        """Stacks permutation() over a batch, B layouts -> 2 B x characters arrays"""
+        pairs = [self.permutation(layout) for layout in layouts]
+        return np.array([pair[0] for pair in pairs]), np.array([pair[1] for pair in pairs])
+
+    def score_permutations(self, char_slots, frequencies=None):
+        """Components for a batch of char_slots rows (B x characters) in one pass.
+        frequencies defaults to the first layout's for every row, which is right for any
+        rearrangement of it made with swap_keys/swap_shifts.
+        Returns a B x len(COMPONENTS) array, already weighted.
+        """
+        char_slots = np.atleast_2d(np.asarray(char_slots, dtype=np.intp))
+        if frequencies is None:
+            frequencies = np.broadcast_to(self.frequencies[0], char_slots.shape)
+        components = np.zeros((len(char_slots), len(COMPONENTS)), dtype=np.float64)
+        weights = self.weights
+        if self.effort is None:
+            components[:, 0] = weights["home_row"] * np.sum(
+                frequencies * self.rows[char_slots], axis=1
+            )
+            components[:, 1] = weights["finger"] * np.sum(
+                frequencies * self.finger_costs[char_slots], axis=1
+            )
+        else:
+            components[:, 2] = weights["effort"] * np.sum(
+                frequencies * self.effort[char_slots], axis=1
+            )
+        components[:, 3] = weights["bigram"] * self.pair_score(
+            char_slots, self.bigram_chars, self.bigram_counts
+        )
+        if weights["skipgram"]:
+            components[:, 4] = weights["skipgram"] * self.pair_score(
+                char_slots, self.skipgram_chars, self.skipgram_counts
+            )
+        if weights["trigram"] and len(self.trigram_counts):
+            components[:, 5] = weights["trigram"] * self.trigram_score(char_slots)
+        return components
+
+    def trigram_score(self, char_slots):
+        """Unweighted trigram cost of every row, a chunk of rows at a time so the
+        rows x trigrams temporaries stay around TRIGRAM_CHUNK_SIZE whatever the ngram_limit"""
+        rows = max(1, TRIGRAM_CHUNK_SIZE // len(self.trigram_counts))
+        scores = np.empty(len(char_slots), dtype=np.float64)
+        for start in range(0, len(char_slots), rows):
+            fingers = self.finger_ids[char_slots[start : start + rows, self.trigram_chars]]
+            index = (
+                fingers[:, :, 0] * FINGER_COUNT + fingers[:, :, 1]
+            ) * FINGER_COUNT + fingers[:, :, 2]
+            scores[start : start + rows] = self.trigram_costs[index] @ self.trigram_counts
+        return scores
+
+    def pair_score(self, char_slots, pairs, counts):
+        if not len(counts):
+            return 0.0
+        penalties = self.penalties[char_slots[:, pairs[:, 0]], char_slots[:, pairs[:, 1]]]
+        return penalties @ counts
+
+    def score(self):
+        """Scores and breakdowns of every layout given to the constructor, in that order"""
+        components = self.score_permutations(self.char_slots, self.frequencies)
+        results = []
+        for name, row in zip(self.names, components):
+            result = {"layout": name, "score": float(row.sum())}
+            result.update(
+                {component: float(value) for component, value in zip(COMPONENTS, row)}
+            )
+            results.append(result)
+        return results
+
+
+def score_layouts(corpus, layouts, **weights):
+    """One call version of BatchScorer(corpus, layouts, **weights).score()"""
+    return BatchScorer(corpus, layouts, **weights).score()
+
+
+if __name__ == "__main__":
+    import Project
+    from corpus_stats import load_corpus_stats
+
+    parser = argparse.ArgumentParser(
+        description="Score and rank a batch of layouts against one or more corpora"
+    )
+    parser.add_argument("layouts", nargs="+", help="layout json files")
+    parser.add_argument(
+        "--corpus",
+        nargs="+",
+        default=[Project.corpus_file],
+        help="every layout is scored against each",
+    )
+    parser.add_argument("--heatmap", default=Project.heatmap_file)
+    parser.add_argument("--output", default=None, help="write the results as json")
+    args = parser.parse_args()
+
+    weights = dict(
+        home_row_weight=Project.home_row_weight,
+        finger_weight=Project.finger_weight,
+        bigram_weight=Project.bigram_weight,
+        same_finger_penalty=Project.same_finger_penalty,
+        same_hand_penalty=Project.same_hand_penalty,
+        trigram_weight=Project.trigram_weight,
+        skipgram_weight=Project.skipgram_weight,
+        trigram_penalties=Project.trigram_penalties,
+        effort_weight=Project.effort_weight,
+        heatmap=args.heatmap,
+    )
+    all_results = {}
+    for corpus_file in args.corpus:
+        corpus = load_corpus_stats(corpus_file, count_trigrams=Project.uses_trigrams())
+        results = sorted(
+            score_layouts(corpus, args.layouts, **weights), key=lambda result: result["score"]
+        )
+        all_results[corpus_file] = results
+        print(f"{corpus_file}:")
+        for rank, result in enumerate(results, 1):
+            breakdown = " | ".join(
+                f"{component} {result[component]:.2f}"
+                for component in COMPONENTS
+                if result[component]
+            )
+            print(f"{rank:4}. {result['score']:12.2f}  {result['layout']}  ({breakdown})")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(all_results, f, indent=4)
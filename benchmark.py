@@ -0,0 +1,236 @@
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import Project
+from Project import KeyboardLayout, anneal
+from corpus_stats import CorpusStats
+from schedules import BudgetSchedule
+
+# Bits of Java the synthetic corpora are made of, so the character mix is roughly what we optimize for
+TOKENS = [
+    "public", "private", "static", "final", "void", "int", "String", "return", "new",
+    "class", "if", "else", "for", "while", "import", "this", "null", "true", "false",
+    "List", "Map", "get", "set", "value", "index", "result", "count", "name", "i", "x",
+    "(", ")", "{", "}", "[", "]", ";", ",", ".", "=", "==", "+", "-", "*", "/", "<", ">",
+    "!", "&&", "||", "\"", "'", ":", "?", "@Override", "0", "1", "2", "10", "//", "_",
+]  # fmt: skip
+
+# Sizes (in characters) of the synthetic corpora
+SIZES = {"small": 64_000, "medium": 1_000_000, "large": 8_000_000}
+
+# Scores of qwerty.json/dvorak.json against each synthetic corpus with Project.py's weights,
+# if these move then a "performance" change also changed the results
+REFERENCE_SCORES = {
+    "small": {"qwerty": 703.1901585, "dvorak": 485.538088},
+    "medium": {"qwerty": 10698.286571, "dvorak": 7411.0674925},
+    "large": {"qwerty": 85455.5576435, "dvorak": 59215.0523},
+}
+# Against the real Java corpus, from the comment next to the balance factors in Project.py
+JAVA_REFERENCE_SCORES = {"qwerty": 46000, "dvorak": 30000}
+TOLERANCE = 1e-6  # relative
+
+
+def synthetic_corpus(size, seed=0):
+    """Deterministic Java-ish text of exactly size characters"""
+    rng = random.Random(seed)
+    pieces = []
+    length = 0
+    indent = 0
+    while length < size:
+        line_length = rng.randint(2, 12)
+        line = " " * (4 * indent) + " ".join(rng.choice(TOKENS) for _ in range(line_length))
+        if line.endswith("{"):
+            indent = min(indent + 1, 4)
+        elif line.endswith("}"):
+            indent = max(indent - 1, 0)
+        pieces.append(line + "\n")
+        length += len(line) + 1
+    return "".join(pieces)[:size]
+
+
+def rate(function, min_seconds=0.5):
+    """Calls function until min_seconds have passed, returns calls per second"""
+    calls = 0
+    started = time.perf_counter()
+    while True:
+        function()
+        calls += 1
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_seconds:
+            return calls / elapsed
+
+
+def peak_memory(function):
+    """Peak bytes allocated by Python while running function"""
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def full_score(layout):
+    return layout.evaluate_total_score(
+        home_row_weight=Project.home_row_weight,
+        finger_weight=Project.finger_weight,
+        bigram_weight=Project.bigram_weight,
+        same_finger_penalty=Project.same_finger_penalty,
+        same_hand_penalty=Project.same_hand_penalty,
+    )
+
+
+def check_score(checks, name, score, expected):
+    if expected is None:
+        return
+    passed = abs(score - expected) <= TOLERANCE * abs(expected)
+    checks.append({"check": name, "score": score, "expected": expected, "passed": passed})
+
+
+def benchmark_corpus(name, text, swaps, min_seconds, checks):
+    megabytes = len(text.encode("utf-8")) / 1e6
+    result = {"characters": len(text), "megabytes": megabytes}
+
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as f:
+        f.write(text)
+        path = f.name
+    try:
+        result["generate_frequencies_mb_per_sec"] = megabytes * rate(
+            lambda: KeyboardLayout.generate_frequencies(None, text), min_seconds
+        )
+        result["streaming_ingest_mb_per_sec"] = megabytes * rate(
+            lambda: CorpusStats.from_file(path), min_seconds
+        )
+        result["generate_frequencies_peak_bytes"] = peak_memory(
+            lambda: KeyboardLayout.generate_frequencies(None, text)
+        )
+        result["streaming_ingest_peak_bytes"] = peak_memory(
+            lambda: CorpusStats.from_file(path)
+        )
+    finally:
+        os.remove(path)
+
+    corpus = CorpusStats.from_text(text)
+    for layout_name in ("qwerty", "dvorak"):
+        layout = KeyboardLayout(f"./{layout_name}.json", corpus)
+        score = full_score(layout)
+        result[f"{layout_name}_score"] = score
+        result[f"{layout_name}_evaluations_per_sec"] = rate(
+            lambda: full_score(layout), min_seconds
+        )
+        check_score(
+            checks,
+            f"{name} {layout_name} matches reference",
+            score,
+            REFERENCE_SCORES.get(name, {}).get(layout_name),
+        )
+        check_score(
+            checks,
+            f"{name} {layout_name} incremental scorer matches full evaluation",
+            Project.make_scorer(layout).score,
+            score,
+        )
+        if Project.use_numpy:
+            check_score(
+                checks,
+                f"{name} {layout_name} numpy scorer matches full evaluation",
+                Project.make_scorer(layout, batch=True).score,
+                score,
+            )
+
+    layout = KeyboardLayout("./dvorak.json", corpus)
+    random.seed(400)
+    schedule = BudgetSchedule(temperature=1000, evaluations=swaps)
+    started = time.perf_counter()
+    best_layout, best_score, _, _, _ = anneal(
+        None, None, layout, True, show_progress=False, schedule=schedule
+    )
+    result["anneal_swaps_per_sec"] = swaps / (time.perf_counter() - started)
+    check_score(
+        checks,
+        f"{name} annealed best score matches full evaluation",
+        best_score,
+        full_score(best_layout),
+    )
+    return result
+
+
+def benchmark_java_corpus(path, checks):
+    """Checks the real corpus against the scores quoted in Project.py (~1% tolerance)"""
+    corpus = CorpusStats.from_file(path)
+    scores = {}
+    for layout_name, expected in JAVA_REFERENCE_SCORES.items():
+        scores[layout_name] = full_score(KeyboardLayout(f"./{layout_name}.json", corpus))
+        checks.append(
+            {
+                "check": f"java corpus {layout_name} near {expected}",
+                "score": scores[layout_name],
+                "expected": expected,
+                "passed": abs(scores[layout_name] - expected) <= 0.01 * expected,
+            }
+        )
+    return scores
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(sizes=("small", "medium"), swaps=20000, min_seconds=0.5, java_corpus=None):
+    checks = []
+    results = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "backend": "numpy" if Project.use_numpy else "python",
+        "corpora": {},
+        "checks": checks,
+    }
+    for name in sizes:
+        text = synthetic_corpus(SIZES[name])
+        results["corpora"][name] = benchmark_corpus(name, text, swaps, min_seconds, checks)
+    if java_corpus:
+        results["java_corpus"] = benchmark_java_corpus(java_corpus, checks)
+    # ru_maxrss is in kilobytes on Linux
+    results["peak_rss_bytes"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    results["passed"] = all(check["passed"] for check in checks)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Scoring, annealing and corpus ingest throughput, written out as JSON"
+    )
+    parser.add_argument(
+        "--sizes", nargs="+", default=["small", "medium"], choices=list(SIZES)
+    )
+    parser.add_argument("--swaps", type=int, default=20000, help="anneal() iterations timed")
+    parser.add_argument("--min-seconds", type=float, default=0.5)
+    parser.add_argument("--java-corpus", default=None, help="also check the real corpus' scores")
+    parser.add_argument("--output", default=None, help="write the JSON here instead of stdout")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.sizes, args.swaps, args.min_seconds, args.java_corpus)
+    output = json.dumps(results, indent=4)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+    for check in results["checks"]:
+        if not check["passed"]:
+            print(f"FAILED: {check['check']} ({check['score']} vs {check['expected']})", file=sys.stderr)
+    sys.exit(0 if results["passed"] else 1)
@@ -0,0 +1,91 @@
+import gzip
+import json
+import os
+import threading
+import time
+
+CHECKPOINT_VERSION = 1
+
+
+def write_checkpoint(path, state):
+    """gzipped json, written to a temp file first so a crash mid-write leaves the last one intact"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temp_path = path + ".tmp"
+    with gzip.open(temp_path, "wt", encoding="utf-8") as f:
+        json.dump({"version": CHECKPOINT_VERSION, **state}, f, ensure_ascii=False)
+    os.replace(temp_path, path)
+
+
+def read_checkpoint(path):
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        state = json.load(f)
+    if state.get("version") != CHECKPOINT_VERSION:
+        raise ValueError(
+            f"{path} is a version {state.get('version')} checkpoint, "
+            f"expected {CHECKPOINT_VERSION}"
+        )
+    return state
+
+
+def random_state_to_json(state):
+    """random.getstate() as lists, the tuples don't survive json"""
+    version, internal, gauss_next = state
+    return [version, list(internal), gauss_next]
+
+
+def random_state_from_json(state):
+    version, internal, gauss_next = state
+    return (version, tuple(internal), gauss_next)
+
+
+class Checkpointer:
+    """Saves anneal()'s state to path every `seconds` seconds.
+    The loop only snapshots the state (a few small copies), turning it into json, compressing
+    and writing it happens on a background thread so the iterations don't stall on disk.
+    If a write is still going when the next snapshot comes in only the newest one is kept.
+    """
+
+    check_every = 1000  # iterations between looking at the clock
+
+    def __init__(self, path, seconds=300.0):
+        self.path = path
+        self.seconds = seconds
+        self.last_saved = time.perf_counter()
+        self.writes = 0
+        self.pending = None
+        self.closed = False
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.thread = threading.Thread(target=self._writer, daemon=True)
+        self.thread.start()
+
+    def due(self, iteration):
+        return (
+            iteration % self.check_every == 0
+            and time.perf_counter() - self.last_saved >= self.seconds
+        )
+
+    def save(self, state):
+        """Queues a snapshot, returns straight away"""
+        self.last_saved = time.perf_counter()
+        with self.lock:
+            self.pending = state
+        self.wake.set()
+
+    def _writer(self):
+        while True:
+            self.wake.wait()
+            self.wake.clear()
+            with self.lock:
+                state, self.pending = self.pending, None
+            if state is not None:
+                write_checkpoint(self.path, state)
+                self.writes += 1
+            if self.closed and self.pending is None:
+                return
+
+    def close(self):
+        """Waits for anything still queued to be written"""
+        self.closed = True
+        self.wake.set()
+        self.thread.join()
@@ -0,0 +1,373 @@
+import gzip
+import hashlib
+import json
+import os
+from collections import Counter
+from functools import partial
+from itertools import islice
+
+CHUNK_SIZE = 1 << 20  # characters read at a time, keeps memory flat no matter how big the corpus is
+CACHE_DIR = "./.corpus_cache"
+CACHE_VERSION = 2
+
+# Everything str.splitlines() breaks on, bigrams never span these
+# (\r\n is 2 characters but both of them are in here so it works out the same)
+LINE_BREAKS = frozenset("\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029")
+
+
+class CorpusStats:
+    """Single letter and bigram counts for a corpus, what KeyboardLayout scores against.
+    Same counts as KeyboardLayout.generate_frequencies but built a chunk at a time.
+
+    With count_trigrams it also counts trigrams and distance-2 skipgrams (first and third
+    character of every trigram). Those tables get big on large corpora, ngram_limit keeps
+    only the most frequent ones (see prune).
+    """
+
+    def __init__(
+        self,
+        frequencies=None,
+        bigrams=None,
+        trigrams=None,
+        skipgrams=None,
+        count_trigrams=False,
+        ngram_limit=None,
+    ):
+        self.frequencies = frequencies if frequencies is not None else Counter()
+        self.bigrams = bigrams if bigrams is not None else Counter()
+        self.count_trigrams = count_trigrams or trigrams is not None
+        self.trigrams = trigrams if trigrams is not None else Counter()
+        self.skipgrams = skipgrams if skipgrams is not None else Counter()
+        self.ngram_limit = ngram_limit
+
+    def add_text(self, text, previous=""):
+        """Counts a piece of text
+        previous is the end of the piece before this one (the last 2 characters are used),
+        so n-grams split across 2 chunks are still counted
+        """
+        for char, count in Counter(text).items():
+            self.frequencies[char.lower()] += count
+        joined = previous[-1:] + text
+        for (char1, char2), count in Counter(zip(joined, islice(joined, 1, None))).items():
+            if char1 in LINE_BREAKS or char2 in LINE_BREAKS:
+                continue
+            self.bigrams[(char1.lower(), char2.lower())] += count
+
+        if not self.count_trigrams:
+            return
+        joined = previous[-2:] + text
+        windows = zip(joined, islice(joined, 1, None), islice(joined, 2, None))
+        for (char1, char2, char3), count in Counter(windows).items():
+            if char1 in LINE_BREAKS or char2 in LINE_BREAKS or char3 in LINE_BREAKS:
+                continue
+            char1 = char1.lower()
+            char3 = char3.lower()
+            self.trigrams[(char1, char2.lower(), char3)] += count
+            self.skipgrams[(char1, char3)] += count
+        if self.ngram_limit is not None and len(self.trigrams) > 2 * self.ngram_limit:
+            self.prune(top_n=self.ngram_limit)
+
+    def prune(self, top_n=None, min_count=None):
+        """Drops rare trigrams and skipgrams, keeps the top_n most common and/or the ones
+        seen at least min_count times. Unigrams and bigrams are always kept whole.
+        While counting this is approximate (something pruned early can't come back), which
+        is fine for the long tail it's meant to cut off.
+        """
+        for table in (self.trigrams, self.skipgrams):
+            if min_count is not None:
+                for ngram in [ngram for ngram, count in table.items() if count < min_count]:
+                    del table[ngram]
+            if top_n is not None and len(table) > top_n:
+                keep = dict(table.most_common(top_n))
+                table.clear()
+                table.update(keep)
+        return self
+
+    @classmethod
+    def from_text(cls, text, count_trigrams=False, ngram_limit=None):
+        stats = cls(count_trigrams=count_trigrams, ngram_limit=ngram_limit)
+        stats.add_text(text)
+        return stats
+
+    @classmethod
+    def from_file(
+        cls, path, chunk_size=CHUNK_SIZE, encoding=None, count_trigrams=False, ngram_limit=None
+    ):
+        """Streams a text file through add_text without ever holding all of it"""
+        stats = cls(count_trigrams=count_trigrams, ngram_limit=ngram_limit)
+        previous = ""
+        with open(path, "r", encoding=encoding) as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                stats.add_text(chunk, previous)
+                previous = (previous + chunk)[-2:]
+        if ngram_limit is not None:
+            stats.prune(top_n=ngram_limit)
+        return stats
+
+    def update(self, other):
+        """Adds another CorpusStats' counts into this one"""
+        self.frequencies.update(other.frequencies)
+        self.bigrams.update(other.bigrams)
+        self.trigrams.update(other.trigrams)
+        self.skipgrams.update(other.skipgrams)
+        if self.ngram_limit is not None:
+            self.prune(top_n=self.ngram_limit)
+        return self
+
+    def subtract(self, other):
+        """Takes another CorpusStats' counts back out of this one, the other way round from
+        update(). N-grams that get down to 0 are dropped. Only exact if neither was pruned."""
+        tables = [
+            (self.frequencies, other.frequencies),
+            (self.bigrams, other.bigrams),
+            (self.trigrams, other.trigrams),
+            (self.skipgrams, other.skipgrams),
+        ]
+        for table, other_table in tables:
+            for ngram, count in other_table.items():
+                remaining = table.get(ngram, 0) - count
+                if remaining > 0:
+                    table[ngram] = remaining
+                else:
+                    table.pop(ngram, None)
+        return self
+
+    def copy(self):
+        return CorpusStats(
+            Counter(self.frequencies),
+            Counter(self.bigrams),
+            Counter(self.trigrams) if self.count_trigrams else None,
+            Counter(self.skipgrams),
+            self.count_trigrams,
+            self.ngram_limit,
+        )
+
+    def to_json(self):
+        data = {
+            "frequencies": dict(self.frequencies),
+            "bigrams": [[char1, char2, count] for (char1, char2), count in self.bigrams.items()],
+        }
+        if self.count_trigrams:
+            data["trigrams"] = [[*trigram, count] for trigram, count in self.trigrams.items()]
+            data["skipgrams"] = [[*skipgram, count] for skipgram, count in self.skipgrams.items()]
+            data["ngram_limit"] = self.ngram_limit
+        return data
+
+    @classmethod
+    def from_json(cls, data):
+        stats = cls(
+            Counter(data["frequencies"]),
+            Counter({(char1, char2): count for char1, char2, count in data["bigrams"]}),
+        )
+        if "trigrams" in data:
+            stats.count_trigrams = True
+            stats.ngram_limit = data.get("ngram_limit")
+            stats.trigrams = Counter({tuple(row[:3]): row[3] for row in data["trigrams"]})
+            stats.skipgrams = Counter({tuple(row[:2]): row[2] for row in data["skipgrams"]})
+        return stats
+
+
+def mix_corpus_stats(weighted_stats):
+    """Mixes several corpora into one table, weighted_stats is [(CorpusStats, weight), ...].
+    Each corpus is normalized by its size first so the weights are shares of typing
+    (0.6, 0.3, 0.1 means 60% of what's typed looks like the first corpus) whatever size the
+    files are, then everything is scaled back up to the weighted average size so scores stay
+    in the same range as a single corpus. Counts become floats.
+    A single corpus is returned as it is.
+    """
+    if len(weighted_stats) == 1:
+        return weighted_stats[0][0]
+    total_weight = sum(weight for _, weight in weighted_stats)
+    sizes = [sum(stats.frequencies.values()) for stats, _ in weighted_stats]
+    size = sum(weight / total_weight * n for (_, weight), n in zip(weighted_stats, sizes))
+    mixed = CorpusStats(count_trigrams=all(stats.count_trigrams for stats, _ in weighted_stats))
+    for (stats, weight), n in zip(weighted_stats, sizes):
+        if not n or not weight:
+            continue
+        scale = weight / total_weight * size / n
+        tables = [(mixed.frequencies, stats.frequencies), (mixed.bigrams, stats.bigrams)]
+        if mixed.count_trigrams:
+            tables += [(mixed.trigrams, stats.trigrams), (mixed.skipgrams, stats.skipgrams)]
+        for mixed_table, table in tables:
+            for ngram, count in table.items():
+                mixed_table[ngram] += count * scale
+    return mixed
+
+
+def list_corpus_files(input_directory):
+    """Every file merge_corpus.merge_text_files would pick up, in the same order"""
+    paths = []
+    for root, _, files in os.walk(input_directory):
+        for file in files:
+            if not file.startswith("."):  # Skip hidden or temporary files
+                paths.append(os.path.join(root, file))
+    return paths
+
+
+def count_file(file_path, chunk_size=CHUNK_SIZE, count_trigrams=False, ngram_limit=None):
+    """Counts one source file the way it'd be counted inside a merged corpus, including
+    the newline merge_text_files adds after it. Files that can't be read count as nothing.
+    """
+    try:
+        stats = CorpusStats.from_file(
+            file_path, chunk_size, "utf-8", count_trigrams, ngram_limit
+        )
+    except (UnicodeDecodeError, FileNotFoundError):
+        print(f"Skipping file due to an error: {file_path}")
+        return CorpusStats(count_trigrams=count_trigrams, ngram_limit=ngram_limit)
+    stats.frequencies["\n"] += 1
+    return stats
+
+
+def count_directory(
+    input_directory, workers=None, chunk_size=CHUNK_SIZE, count_trigrams=False, ngram_limit=None
+):
+    """Counts a whole directory of source files across a process pool and adds up the results.
+    Gives the same counts as merging the directory with merge_corpus.py and counting that,
+    without writing the merged file. workers=1 counts everything in this process.
+    """
+    stats = CorpusStats(count_trigrams=count_trigrams, ngram_limit=ngram_limit)
+    counted = count_files(
+        list_corpus_files(input_directory), workers, chunk_size, count_trigrams, ngram_limit
+    )
+    for _, file_stats in counted:
+        stats.update(file_stats)
+    return stats
+
+
+def count_files(paths, workers=None, chunk_size=CHUNK_SIZE, count_trigrams=False, ngram_limit=None):
+    """Counts source files across a process pool, yields (path, stats) in the order given.
+    workers=1 (or a single file) counts in this process."""
+    count = partial(
+        count_file, chunk_size=chunk_size, count_trigrams=count_trigrams, ngram_limit=ngram_limit
+    )
+    if workers == 1 or len(paths) < 2:
+        for path in paths:
+            yield path, count(path)
+        return
+    from multiprocessing import Pool  # only needed here, keeps importing this module cheap
+
+    with Pool(workers) as pool:
+        yield from zip(paths, pool.imap(count, paths, chunksize=8))
+
+
+def hash_file(path, chunk_size=CHUNK_SIZE):
+    """sha256 of a file's contents, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_path(corpus_file, cache_dir=CACHE_DIR):
+    name = hashlib.sha1(os.path.abspath(corpus_file).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(cache_dir, f"{name}.json.gz")
+
+
+def write_cache(path, header, stats):
+    """Writes to a temp file first so a half written cache is never picked up"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temp_path = path + ".tmp"
+    with gzip.open(temp_path, "wt", encoding="utf-8") as f:
+        json.dump({**header, **stats.to_json()}, f, ensure_ascii=False)
+    os.replace(temp_path, path)
+
+
+def read_cache(path):
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if data.get("version") != CACHE_VERSION:
+        return None
+    return data
+
+
+def cache_covers(cached, count_trigrams, ngram_limit):
+    """Whether a cache entry has every table that was asked for"""
+    if not count_trigrams:
+        return True
+    return "trigrams" in cached and cached.get("ngram_limit") == ngram_limit
+
+
+def load_corpus_stats(
+    corpus_file,
+    cache_dir=CACHE_DIR,
+    chunk_size=CHUNK_SIZE,
+    encoding=None,
+    workers=None,
+    count_trigrams=False,
+    ngram_limit=None,
+):
+    """Corpus statistics for a text file, counted once and cached on disk.
+    The cache is reused if the file's size and mtime haven't changed, or if they have
+    but the content hash still matches. Pass cache_dir=None to skip caching.
+    A directory is counted file by file across workers processes and kept in a
+    stats_store.StatsStore, so later calls only count files that are new or changed.
+    count_trigrams and ngram_limit are passed on to CorpusStats, a cache counted without
+    trigrams (or with a different limit) is recounted.
+    A .kbstats file (see packed_stats.py) is memory-mapped and used as it is, it can't be
+    recounted so asking for trigrams from one packed without them is an error.
+    """
+    if corpus_file.endswith(".kbstats"):  # packed_stats.PACKED_SUFFIX
+        from packed_stats import open_packed_stats  # packed_stats imports this module
+
+        stats = open_packed_stats(corpus_file)
+        if count_trigrams and not stats.count_trigrams:
+            stats.close()
+            raise ValueError(
+                f"{corpus_file} was packed without trigrams, pack it again with --trigrams "
+                "to use trigram or skipgram weights"
+            )
+        return stats
+    if os.path.isdir(corpus_file):
+        if cache_dir is None:
+            return count_directory(corpus_file, workers, chunk_size, count_trigrams, ngram_limit)
+        from stats_store import refresh_store  # stats_store imports this module
+
+        name = hashlib.sha1(os.path.abspath(corpus_file).encode("utf-8")).hexdigest()[:16]
+        return refresh_store(
+            corpus_file, os.path.join(cache_dir, name), workers, count_trigrams, ngram_limit
+        )
+    if cache_dir is None:
+        return CorpusStats.from_file(
+            corpus_file, chunk_size, encoding, count_trigrams, ngram_limit
+        )
+
+    file_stat = os.stat(corpus_file)
+    path = cache_path(corpus_file, cache_dir)
+    cached = read_cache(path)
+    if cached is not None and not cache_covers(cached, count_trigrams, ngram_limit):
+        cached = None
+    if (
+        cached is not None
+        and cached["mtime_ns"] == file_stat.st_mtime_ns
+        and cached["size"] == file_stat.st_size
+    ):
+        return CorpusStats.from_json(cached)
+
+    content_hash = hash_file(corpus_file, chunk_size)
+    header = {
+        "version": CACHE_VERSION,
+        "source": os.path.abspath(corpus_file),
+        "mtime_ns": file_stat.st_mtime_ns,
+        "size": file_stat.st_size,
+        "sha256": content_hash,
+    }
+    if cached is not None and cached["sha256"] == content_hash:
+        # Touched but not changed, just refresh the mtime
+        stats = CorpusStats.from_json(cached)
+    else:
+        stats = CorpusStats.from_file(
+            corpus_file, chunk_size, encoding, count_trigrams, ngram_limit
+        )
+    write_cache(path, header, stats)
+    return stats
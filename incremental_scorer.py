@@ -0,0 +1,291 @@
+from collections import defaultdict
+from Key import Key
+from ngram_scoring import FINGER_COUNT, finger_id, trigram_cost_table
+
+
+def moved_by_swap_keys(char_locations, key1: Key, key2: Key):
+    """Which characters swap_keys(key1, key2) would move and where they'd end up
+    None if the swap would be silently skipped
+    """
+    if key1.is_immovable or key2.is_immovable:
+        return None
+    moved = {}
+    for char in (key1.base, key1.shift):
+        if char_locations.get(char) == key1.location:
+            moved[char] = key2.location
+    for char in (key2.base, key2.shift):
+        if char_locations.get(char) == key2.location:
+            moved[char] = key1.location
+    return moved
+
+
+def moved_by_swap_shifts(char_locations, key1: Key, key2: Key):
+    """Which characters swap_shifts(key1, key2) would move and where they'd end up
+    None if the swap would be silently skipped
+    """
+    if key1.is_immutable or key2.is_immutable:
+        return None
+    if key1.base == key1.shift or key2.base == key2.shift:
+        return None
+    if key1.is_immovable or key2.is_immovable:
+        return None
+    moved = {}
+    if char_locations.get(key1.shift) == key1.location:
+        moved[key1.shift] = key2.location
+    if char_locations.get(key2.shift) == key2.location:
+        moved[key2.shift] = key1.location
+    return moved
+
+
+def moved_by_cycle_keys(char_locations, key1: Key, key2: Key, key3: Key):
+    """Which characters cycling 3 keys would move (key1 to key2's spot, key2 to key3's and
+    key3 to key1's, what swap_keys(key1, key2) then swap_keys(key2, key3) does) and where
+    they'd end up. None if any of them is immovable
+    """
+    if key1.is_immovable or key2.is_immovable or key3.is_immovable:
+        return None
+    moved = {}
+    for key, target in ((key1, key2), (key2, key3), (key3, key1)):
+        for char in (key.base, key.shift):
+            if char_locations.get(char) == key.location:
+                moved[char] = target.location
+    return moved
+
+
+class IncrementalScorer:
+    """Keeps the score of a KeyboardLayout up to date one swap at a time.
+    A swap only moves the characters on the two keys involved, so only the bigrams
+    touching those characters need to be looked at instead of the whole corpus.
+    Trigrams and skipgrams work the same way and are only indexed if they're weighted.
+    """
+
+    def __init__(
+        self,
+        layout,
+        home_row_weight=1,
+        finger_weight=1,
+        bigram_weight=1,
+        same_finger_penalty=3.0,
+        same_hand_penalty=1.5,
+        trigram_weight=0,
+        skipgram_weight=0,
+        trigram_penalties=None,
+        effort_weight=1,
+    ):
+        self.layout = layout
+        self.bigram_weight = bigram_weight
+        self.same_finger_penalty = same_finger_penalty
+        self.same_hand_penalty = same_hand_penalty
+        self.trigram_weight = trigram_weight
+        self.skipgram_weight = skipgram_weight
+
+        # Cost per keystroke, finger and hand for every position, worked out once by the layout
+        self.position_costs = layout.position_costs(home_row_weight, finger_weight, effort_weight)
+        self.fingers = layout.slot_fingers
+        self.hands = layout.slot_hands
+        self.finger_ids = {loc: finger_id(finger) for loc, finger in self.fingers.items()}
+        self.trigram_costs = trigram_cost_table(trigram_penalties)
+
+        # The layout keeps this index in sync itself whenever a swap is applied
+        self.char_locations = layout.char_locations
+
+        # Only n-grams where every character is on the keyboard can ever score
+        self.bigrams_by_char = self.index_ngrams(layout.bigrams)
+        self.skipgrams_by_char = (
+            self.index_ngrams(layout.skipgrams) if skipgram_weight else {}
+        )
+        self.trigrams_by_char = (
+            self.index_ngrams(layout.trigrams) if trigram_weight else {}
+        )
+
+        self.key_contributions = {
+            loc: self.key_contribution(key, loc) for loc, key in layout.layout.items()
+        }
+        self.bigram_contributions = self.contributions(
+            self.bigrams_by_char, self.pair_cost
+        )
+        self.skipgram_contributions = self.contributions(
+            self.skipgrams_by_char, self.pair_cost
+        )
+        self.trigram_contributions = self.contributions(
+            self.trigrams_by_char, self.trigram_cost
+        )
+        self.score = (
+            sum(self.key_contributions.values())
+            + self.bigram_weight * sum(self.bigram_contributions.values())
+            + self.skipgram_weight * sum(self.skipgram_contributions.values())
+            + self.trigram_weight * sum(self.trigram_contributions.values())
+        )
+
+    def index_ngrams(self, ngrams):
+        """character -> every n-gram containing it (once per n-gram) with its count"""
+        by_char = defaultdict(list)
+        char_locations = self.char_locations
+        for ngram, freq in ngrams.items():
+            if all(char in char_locations for char in ngram):
+                for char in dict.fromkeys(ngram):  # each n-gram once per distinct character
+                    by_char[char].append((ngram, freq))
+        return by_char
+
+    def contributions(self, by_char, cost):
+        """Unweighted cost of every indexed n-gram where the layout has it right now"""
+        char_locations = self.char_locations
+        contributions = {}
+        for ngram_list in by_char.values():
+            for ngram, freq in ngram_list:
+                contributions[ngram] = cost([char_locations[char] for char in ngram]) * freq
+        return contributions
+
+    def key_contribution(self, key, loc):
+        """What a key costs if it sat at loc, the slot's cost * frequency like evaluate_total_score"""
+        if key.frequency > 0:
+            return self.position_costs[loc] * key.frequency
+        return 0
+
+    def bigram_penalty(self, loc1, loc2):
+        """Same finger/same hand penalty between 2 locations, mirrors evaluate_bigram_score"""
+        finger1 = self.fingers[loc1]
+        finger2 = self.fingers[loc2]
+        if finger1 and finger2:
+            if finger1 == finger2:
+                return self.same_finger_penalty
+            if self.hands[loc1] == self.hands[loc2]:
+                return self.same_hand_penalty
+        return 0
+
+    def pair_cost(self, locs):
+        return self.bigram_penalty(locs[0], locs[1])
+
+    def trigram_cost(self, locs):
+        """Looked up by the 3 slots' fingers, the trigram is never classified during a run"""
+        finger_ids = self.finger_ids
+        return self.trigram_costs[
+            (finger_ids[locs[0]] * FINGER_COUNT + finger_ids[locs[1]]) * FINGER_COUNT
+            + finger_ids[locs[2]]
+        ]
+
+    def _bigram_delta(self, moved):
+        """Score change over every bigram touching a moved character
+        moved maps character -> the location it would end up at
+        """
+        delta = 0
+        new_contributions = {}
+        char_locations = self.char_locations
+        for char in moved:
+            for bigram, freq in self.bigrams_by_char.get(char, ()):
+                if bigram in new_contributions:
+                    continue
+                loc1 = moved.get(bigram[0], char_locations[bigram[0]])
+                loc2 = moved.get(bigram[1], char_locations[bigram[1]])
+                new_contributions[bigram] = self.bigram_penalty(loc1, loc2) * freq
+                delta += new_contributions[bigram] - self.bigram_contributions[bigram]
+        return delta * self.bigram_weight, new_contributions
+
+    def _ngram_delta(self, moved, by_char, contributions, cost):
+        """Same as _bigram_delta for the skipgram and trigram tables, unweighted"""
+        delta = 0
+        new_contributions = {}
+        char_locations = self.char_locations
+        for char in moved:
+            for ngram, freq in by_char.get(char, ()):
+                if ngram in new_contributions:
+                    continue
+                locs = [moved.get(c, char_locations[c]) for c in ngram]
+                new_contributions[ngram] = cost(locs) * freq
+                delta += new_contributions[ngram] - contributions[ngram]
+        return delta, new_contributions
+
+    def _delta(self, moved):
+        """Score change over every n-gram touching a moved character, plus the new
+        contributions to store per table if the move is applied"""
+        delta, new_bigrams = self._bigram_delta(moved)
+        changes = [(self.bigram_contributions, new_bigrams)]
+        if self.skipgram_weight:
+            skipgram_delta, new_skipgrams = self._ngram_delta(
+                moved, self.skipgrams_by_char, self.skipgram_contributions, self.pair_cost
+            )
+            delta += self.skipgram_weight * skipgram_delta
+            changes.append((self.skipgram_contributions, new_skipgrams))
+        if self.trigram_weight:
+            trigram_delta, new_trigrams = self._ngram_delta(
+                moved, self.trigrams_by_char, self.trigram_contributions, self.trigram_cost
+            )
+            delta += self.trigram_weight * trigram_delta
+            changes.append((self.trigram_contributions, new_trigrams))
+        return delta, changes
+
+    def delta_swap_keys(self, key1: Key, key2: Key):
+        """Score change if swap_keys(key1, key2) were applied, doesn't touch the layout"""
+        moved = moved_by_swap_keys(self.char_locations, key1, key2)
+        if moved is None:
+            return 0
+        delta, _ = self._delta(moved)
+        delta += (
+            self.key_contribution(key1, key2.location)
+            + self.key_contribution(key2, key1.location)
+            - self.key_contributions[key1.location]
+            - self.key_contributions[key2.location]
+        )
+        return delta
+
+    def delta_swap_shifts(self, key1: Key, key2: Key):
+        """Score change if swap_shifts(key1, key2) were applied, doesn't touch the layout"""
+        moved = moved_by_swap_shifts(self.char_locations, key1, key2)
+        if moved is None:
+            return 0
+        delta, _ = self._delta(moved)
+        return delta
+
+    def delta_cycle_keys(self, key1: Key, key2: Key, key3: Key):
+        """Score change if the 3 keys were cycled (see moved_by_cycle_keys), doesn't touch the layout"""
+        moved = moved_by_cycle_keys(self.char_locations, key1, key2, key3)
+        if moved is None:
+            return 0
+        delta, _ = self._delta(moved)
+        delta += (
+            self.key_contribution(key1, key2.location)
+            + self.key_contribution(key2, key3.location)
+            + self.key_contribution(key3, key1.location)
+            - self.key_contributions[key1.location]
+            - self.key_contributions[key2.location]
+            - self.key_contributions[key3.location]
+        )
+        return delta
+
+    def apply_cycle_keys(self, key1: Key, key2: Key, key3: Key):
+        """Cycles the 3 keys, as 2 swaps"""
+        self.apply_swap_keys(key1, key2)
+        self.apply_swap_keys(key2, key3)
+
+    def apply_swap_keys(self, key1: Key, key2: Key):
+        """Swaps the keys in the layout and updates the stored contributions"""
+        moved = moved_by_swap_keys(self.char_locations, key1, key2)
+        if moved is None:
+            return
+        loc1 = key1.location
+        loc2 = key2.location
+        delta, changes = self._delta(moved)
+        new_key1 = self.key_contribution(key1, loc2)
+        new_key2 = self.key_contribution(key2, loc1)
+        delta += (
+            new_key1 + new_key2 - self.key_contributions[loc1] - self.key_contributions[loc2]
+        )
+
+        self.layout.swap_keys(key1, key2)
+        self.key_contributions[loc1] = new_key2
+        self.key_contributions[loc2] = new_key1
+        self._commit(changes, delta)
+
+    def apply_swap_shifts(self, key1: Key, key2: Key):
+        """Swaps the shift layer in the layout and updates the stored contributions"""
+        moved = moved_by_swap_shifts(self.char_locations, key1, key2)
+        if moved is None:
+            return
+        delta, changes = self._delta(moved)
+        self.layout.swap_shifts(key1, key2)
+        self._commit(changes, delta)
+
+    def _commit(self, changes, delta):
+        for contributions, new_contributions in changes:
+            contributions.update(new_contributions)
+        self.score += delta
@@ -0,0 +1,110 @@
+import sys
+import time
+
+# The parts of an annealing iteration Timings splits the time into
+PHASES = ("move_generation", "scoring", "acceptance", "bookkeeping")
+
+
+class Timings:
+    """Seconds spent in each part of anneal()'s iterations, pass one in as anneal(timings=...)
+        move_generation: picking the 2 keys and the kind of swap
+        scoring: the score change of the swap, and applying it if it's accepted
+        acceptance: the Metropolis test
+        bookkeeping: everything else (best layout, history, schedule, checkpoints, progress)
+    It's filled in as the run goes so it can be read live, summary() is for the end.
+    """
+
+    def __init__(self):
+        self.iterations = 0
+        self.move_generation = 0.0
+        self.scoring = 0.0
+        self.acceptance = 0.0
+        self.bookkeeping = 0.0
+        self.step_finished = None  # when the last step ended, see Project.timed_metropolis_step
+
+    def total(self):
+        return sum(getattr(self, phase) for phase in PHASES)
+
+    def summary(self):
+        """Seconds, share of the total and microseconds per iteration for every phase"""
+        total = self.total()
+        summary = {"iterations": self.iterations, "seconds": total}
+        for phase in PHASES:
+            seconds = getattr(self, phase)
+            summary[phase] = {
+                "seconds": seconds,
+                "fraction": seconds / total if total else 0.0,
+                "microseconds_per_iteration": (
+                    seconds / self.iterations * 1e6 if self.iterations else 0.0
+                ),
+            }
+        return summary
+
+    def format(self):
+        """Short one line breakdown for the progress bar"""
+        total = self.total() or 1.0
+        return " ".join(
+            f"{phase.split('_')[0]} {getattr(self, phase) / total * 100:.0f}%"
+            for phase in PHASES
+        )
+
+    def report(self):
+        """Multi line breakdown for the end of a run"""
+        summary = self.summary()
+        lines = [f"Time per iteration over {summary['iterations']} iterations:"]
+        for phase in PHASES:
+            lines.append(
+                f"    {phase:<16} {summary[phase]['microseconds_per_iteration']:8.2f} us"
+                f" | {summary[phase]['fraction'] * 100:5.1f}%"
+            )
+        return "\n".join(lines)
+
+
+class Progress:
+    """The progress bar, redrawn at most every interval seconds instead of on every iteration
+    so a fast run doesn't spend its time printing. The clock is only read every check_every
+    iterations.
+    """
+
+    bar_length = 50
+    check_every = 100
+
+    def __init__(self, interval=0.25, timings=None, stream=None):
+        self.interval = interval
+        self.timings = timings
+        self.stream = stream if stream is not None else sys.stdout
+        self.last_drawn = time.perf_counter()
+        self.last_iteration = 0
+
+    def update(self, iteration, schedule, score):
+        if iteration % self.check_every:
+            return
+        now = time.perf_counter()
+        if now - self.last_drawn >= self.interval:
+            self.draw(iteration, schedule, score, now)
+
+    def draw(self, iteration, schedule, score, now=None):
+        if now is None:
+            now = time.perf_counter()
+        elapsed = now - self.last_drawn
+        rate = (iteration - self.last_iteration) / elapsed if elapsed > 0 else 0.0
+        self.last_drawn = now
+        self.last_iteration = iteration
+
+        percentage_done = schedule.progress() * 100
+        filled_length = int(self.bar_length * percentage_done / 100)
+        bar = "=" * filled_length + "-" * (self.bar_length - filled_length)
+        line = (
+            f"\rProgress: [{bar}] {percentage_done:.2f}% | Temperature: {schedule.temperature:.2f}"
+            f" | Score: {score:.2f} | {rate:,.0f} it/s"
+        )
+        if self.timings is not None:
+            line += f" | {self.timings.format()}"
+        self.stream.write(line)
+        self.stream.flush()
+
+    def finish(self, iteration, schedule, score):
+        """Draws the final state and ends the line"""
+        self.draw(iteration, schedule, score)
+        self.stream.write("\n")
+        self.stream.flush()
@@ -1,4 +1,5 @@
 import json
+import sys
 
 highlights = [
     "e",
@@ -11,11 +12,6 @@ highlights = [
     "h",
 ]  # the 8 most common letters in english
 
-with open("best_annealed_layout.json", "r") as f:
-    keyboard_layout_json = f.read()
-
-keyboard_layout = json.loads(keyboard_layout_json)
-
 
 def render_keyboard(layout):
     """Renders a json defined keyboard to text, highlights the 8 most common english letters"""
@@ -33,4 +29,10 @@ def render_keyboard(layout):
         print(line)
 
 
-# render_keyboard(keyboard_layout)
+if __name__ == "__main__":
+    filename = sys.argv[1] if len(sys.argv) > 1 else "best_annealed_layout.json"
+    with open(filename, "r") as f:
+        keyboard_layout_json = f.read()
+
+    keyboard_layout = json.loads(keyboard_layout_json)
+    render_keyboard(keyboard_layout)
@@ -0,0 +1,135 @@
+from array import array
+from collections import defaultdict
+
+
+class LayoutState:
+    """Compact copy of where every character sits: for each slot (location) the index of its
+    base and shift character. The slots and the character table are shared between copies,
+    so a snapshot is just 2 small array copies, cheap enough to take on every new best.
+    """
+
+    __slots__ = ("slots", "chars", "char_ids", "immovable", "base", "shift")
+
+    def __init__(self, slots, chars, immovable, base, shift, char_ids=None):
+        self.slots = slots  # tuple of locations, same order as KeyboardLayout.layout
+        self.chars = chars  # tuple of every character on the keyboard
+        if char_ids is None:
+            char_ids = {char: i for i, char in enumerate(chars)}
+        self.char_ids = char_ids
+        self.immovable = immovable  # tuple of bools per slot, named keys like shift and enter
+        self.base = base  # array of indexes into chars, one per slot
+        self.shift = shift
+
+    @classmethod
+    def from_layout(cls, layout):
+        """Snapshot of a KeyboardLayout"""
+        slots = tuple(layout.layout)
+        chars = []
+        char_ids = {}
+        for key in layout.layout.values():
+            for char in (key.base, key.shift):
+                if char not in char_ids:
+                    char_ids[char] = len(chars)
+                    chars.append(char)
+        keys = list(layout.layout.values())
+        return cls(
+            slots,
+            tuple(chars),
+            tuple(key.is_immovable for key in keys),
+            array("h", [char_ids[key.base] for key in keys]),
+            array("h", [char_ids[key.shift] for key in keys]),
+            char_ids,
+        )
+
+    @classmethod
+    def from_json(cls, layout_json):
+        """Reads the format written by KeyboardLayout.write_json"""
+        slots = []
+        immovable = []
+        pairs = []
+        for row in layout_json["layout"]:
+            for key_data in row:
+                slots.append((key_data["x"], key_data["y"]))
+                if "name" in key_data:
+                    immovable.append(True)
+                    pairs.append((key_data["name"], key_data["name"]))
+                else:
+                    immovable.append(False)
+                    pairs.append((key_data["base"], key_data["shift"]))
+        chars = []
+        char_ids = {}
+        for pair in pairs:
+            for char in pair:
+                if char not in char_ids:
+                    char_ids[char] = len(chars)
+                    chars.append(char)
+        return cls(
+            tuple(slots),
+            tuple(chars),
+            tuple(immovable),
+            array("h", [char_ids[base] for base, _ in pairs]),
+            array("h", [char_ids[shift] for _, shift in pairs]),
+            char_ids,
+        )
+
+    def copy(self):
+        return LayoutState(
+            self.slots,
+            self.chars,
+            self.immovable,
+            array("h", self.base),
+            array("h", self.shift),
+            self.char_ids,
+        )
+
+    def capture(self, layout):
+        """Overwrites this snapshot with the current state of layout, which must have the
+        same keys as the one this snapshot was made from. No allocation, O(keys).
+        """
+        char_ids = self.char_ids
+        for i, loc in enumerate(self.slots):
+            key = layout.layout[loc]
+            self.base[i] = char_ids[key.base]
+            self.shift[i] = char_ids[key.shift]
+        return self
+
+    def apply_to(self, layout):
+        """Puts a KeyboardLayout back into this state by moving its own Key objects around"""
+        keys_by_base = {key.base: key for key in layout.layout.values()}
+        for i, loc in enumerate(self.slots):
+            key = keys_by_base[self.chars[self.base[i]]]
+            key.set_location(loc)
+            key.shift = self.chars[self.shift[i]]
+            layout.layout[loc] = key
+        layout.char_locations.clear()
+        for key in layout.layout.values():
+            layout.index_key(key)
+        return layout
+
+    def to_json(self):
+        """Same format as KeyboardLayout.write_json"""
+        rows_dict = defaultdict(list)
+        for i, (x, y) in enumerate(self.slots):
+            if self.immovable[i]:
+                key_data = {"name": self.chars[self.base[i]], "x": x, "y": y}
+            else:
+                key_data = {
+                    "base": self.chars[self.base[i]],
+                    "shift": self.chars[self.shift[i]],
+                    "x": x,
+                    "y": y,
+                }
+            rows_dict[y].append(key_data)
+
+        layout_json = {"layout": []}
+        for y, keys_in_row in sorted(rows_dict.items()):
+            layout_json["layout"].append(sorted(keys_in_row, key=lambda k: k["x"]))
+        return layout_json
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, LayoutState)
+            and self.slots == other.slots
+            and [self.chars[i] for i in self.base] == [other.chars[i] for i in other.base]
+            and [self.chars[i] for i in self.shift] == [other.chars[i] for i in other.shift]
+        )
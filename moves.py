@@ -0,0 +1,96 @@
+import random
+from itertools import accumulate
+
+
+class MoveGenerator:
+    """Proposes only swaps that actually change the layout.
+
+    swap_keys does nothing if either key is immovable (shift, enter...), and swap_shifts does
+    nothing for immutable keys (letters), keys whose base and shift are the same or immovable
+    keys. Those are all fixed for a layout, so the legal sets are worked out once:
+        - base swaps: any 2 movable keys
+        - shift swaps: any 2 keys that can swap their shift layer
+
+    weighting="frequency" proposes common characters more often, each key is picked with
+    weight (count + 1) ** exponent of its base character (base swaps) or of the shift
+    character it has at the time (shift swaps).
+    Anything else picks uniformly.
+    """
+
+    def __init__(self, layout, allow_shift_layer_swaps=False, weighting=None, exponent=0.5):
+        self.layout = layout
+        # Sorted so the order (and so the moves picked for a given seed) doesn't depend on
+        # where the keys happen to be, a resumed run has to pick the same moves
+        self.movable = sorted(
+            (key for key in layout.layout.values() if not key.is_immovable),
+            key=lambda key: key.base,
+        )
+        self.shiftable = [
+            key
+            for key in self.movable
+            if not key.is_immutable and key.base != key.shift
+        ]
+        self.allow_shift_layer_swaps = allow_shift_layer_swaps and len(self.shiftable) >= 2
+        self.weighted = weighting == "frequency"
+        self.exponent = exponent
+        self.base_weights = None
+        if self.weighted:
+            self.base_weights = list(
+                accumulate((key.frequency + 1) ** exponent for key in self.movable)
+            )
+
+    def shift_weights(self):
+        # Shift characters move between keys, so these follow the layout as it is now
+        if not self.weighted:
+            return None
+        frequencies = self.layout.frequencies
+        exponent = self.exponent
+        return list(
+            accumulate(
+                (frequencies.get(key.shift, 0) + 1) ** exponent for key in self.shiftable
+            )
+        )
+
+    @staticmethod
+    def pick(choices, cumulative_weights):
+        if cumulative_weights is None:
+            return random.sample(choices, 2)
+        while True:
+            first, second = random.choices(choices, cum_weights=cumulative_weights, k=2)
+            if first != second:
+                return first, second
+
+    def propose(self):
+        """Returns 2 keys and whether it's their shift layer that should be swapped"""
+        if self.allow_shift_layer_swaps and random.random() < 0.5:
+            key1, key2 = self.pick(self.shiftable, self.shift_weights())
+            return key1, key2, True
+        key1, key2 = self.pick(self.movable, self.base_weights)
+        return key1, key2, False
+
+    def base_swaps(self):
+        """Every legal base swap as pairs of keys, for going through the whole neighbourhood"""
+        return [
+            (key1, key2)
+            for i, key1 in enumerate(self.movable)
+            for key2 in self.movable[i + 1 :]
+        ]
+
+    def base_cycles(self):
+        """Every 3-cycle of movable keys (both directions of every 3 keys), see
+        incremental_scorer.moved_by_cycle_keys"""
+        keys = self.movable
+        cycles = []
+        for i, key1 in enumerate(keys):
+            for j in range(i + 1, len(keys)):
+                for key3 in keys[j + 1 :]:
+                    cycles.append((key1, keys[j], key3))
+                    cycles.append((key1, key3, keys[j]))
+        return cycles
+
+    def shift_swaps(self):
+        """Every legal shift swap as pairs of keys"""
+        if not self.allow_shift_layer_swaps:
+            return []
+        keys = self.shiftable
+        return [(key1, key2) for i, key1 in enumerate(keys) for key2 in keys[i + 1 :]]
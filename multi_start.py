@@ -0,0 +1,170 @@
+import argparse
+import json
+import os
+import random
+import time
+from multiprocessing import Pool
+
+import Project
+from Project import STARTING_LAYOUTS, KeyboardLayout, anneal, score
+from corpus_stats import load_corpus_stats
+from packed_stats import init_worker, share_stats, worker_stats
+
+# "random" shuffles the keys of this layout
+random_base = "./qwerty.json"
+
+
+def shuffle_layout(layout: KeyboardLayout, rng, shuffle_shifts=False):
+    """Random permutation of every movable key (and optionally the shift layer), in place"""
+    keys = [key for key in layout.layout.values() if not key.is_immovable]
+    for i in range(len(keys) - 1, 0, -1):
+        j = rng.randint(0, i)
+        if i != j:
+            layout.swap_keys(keys[i], keys[j])
+    if shuffle_shifts:
+        shiftable = [
+            key for key in keys if not key.is_immutable and key.base != key.shift
+        ]
+        for i in range(len(shiftable) - 1, 0, -1):
+            j = rng.randint(0, i)
+            if i != j:
+                layout.swap_shifts(shiftable[i], shiftable[j])
+    return layout
+
+
+def build_starting_layout(start, corpus, rng, allow_shift_layer_swaps=False):
+    """start is "dvorak", "qwerty", "random" or a path to a layout json"""
+    if start == "random":
+        layout = KeyboardLayout(random_base, corpus)
+        return shuffle_layout(layout, rng, allow_shift_layer_swaps)
+    return KeyboardLayout(STARTING_LAYOUTS.get(start, start), corpus)
+
+
+def run_chain(chain):
+    """Runs one annealing chain in a worker, chain is a dict with its id, seed and start"""
+    started = time.perf_counter()
+    rng = random.Random(chain["seed"])
+    layout = build_starting_layout(
+        chain["start"], worker_stats(), rng, chain["allow_shift_layer_swaps"]
+    )
+    starting_score = score(layout)
+
+    # anneal() draws from the module level random, seed it so the chain can be replayed
+    random.seed(chain["seed"])
+    best_layout, best_score, _, history, _ = anneal(
+        chain["temperature"],
+        chain["cooling_rate"],
+        layout,
+        chain["allow_shift_layer_swaps"],
+        show_progress=False,
+    )
+    return {
+        "chain": chain["chain"],
+        "seed": chain["seed"],
+        "start": chain["start"],
+        "starting_score": starting_score,
+        "best_score": best_score,
+        "score": score(best_layout),
+        "accepted_moves": history.accepted,
+        "seconds": time.perf_counter() - started,
+        "layout": best_layout.to_json(),
+    }
+
+
+def run_chains(
+    corpus,
+    chains=None,
+    starts=("dvorak",),
+    seed=None,
+    workers=None,
+    temperature=Project.temperature,
+    cooling_rate=Project.cooling_rate,
+    allow_shift_layer_swaps=True,
+):
+    """Runs independent annealing chains across a process pool.
+    Chain i starts from starts[i % len(starts)] with seed seed + i, seed=None picks one at random
+    so every run is still recorded and can be replayed.
+    Returns the best chain plus the results of every chain.
+    """
+    if chains is None:
+        chains = os.cpu_count()
+    if seed is None:
+        seed = random.SystemRandom().randrange(2**32)
+    jobs = [
+        {
+            "chain": i,
+            "seed": seed + i,
+            "start": starts[i % len(starts)],
+            "temperature": temperature,
+            "cooling_rate": cooling_rate,
+            "allow_shift_layer_swaps": allow_shift_layer_swaps,
+        }
+        for i in range(chains)
+    ]
+
+    started = time.perf_counter()
+    shared = share_stats(corpus)
+    try:
+        with Pool(workers, initializer=init_worker, initargs=(shared.name,)) as pool:
+            results = pool.map(run_chain, jobs)
+    finally:
+        shared.close()
+        shared.unlink()
+
+    scores = [result["score"] for result in results]
+    best = min(results, key=lambda result: result["score"])
+    return {
+        "seed": seed,
+        "best": best,
+        "chains": results,
+        "stats": {
+            "chains": chains,
+            "best_score": best["score"],
+            "worst_score": max(scores),
+            "mean_score": sum(scores) / len(scores),
+            "seconds": time.perf_counter() - started,
+        },
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run independent annealing chains across every core and keep the best"
+    )
+    parser.add_argument("--corpus", default=Project.corpus_file)
+    parser.add_argument("--chains", type=int, default=os.cpu_count())
+    parser.add_argument(
+        "--start",
+        nargs="+",
+        default=["dvorak"],
+        help="dvorak, qwerty, random or a layout json, chains cycle through them",
+    )
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--output", default="best_annealed_layout.json")
+    parser.add_argument("--results", default="chains.json")
+    args = parser.parse_args()
+
+    corpus = load_corpus_stats(args.corpus)
+    results = run_chains(
+        corpus,
+        chains=args.chains,
+        starts=args.start,
+        seed=args.seed,
+        workers=args.workers,
+    )
+    for result in results["chains"]:
+        print(
+            f"Chain {result['chain']} | Seed {result['seed']} | Start {result['start']} | "
+            f"Score {result['score']:.2f} | {result['seconds']:.1f}s"
+        )
+    stats = results["stats"]
+    print(
+        f"Best: {stats['best_score']:.2f} | Mean: {stats['mean_score']:.2f} | "
+        f"Worst: {stats['worst_score']:.2f} | Seed: {results['seed']}"
+    )
+    with open(args.output, "w") as f:
+        json.dump(results["best"]["layout"], f, indent=4)
+    with open(args.results, "w") as f:
+        json.dump(results, f, indent=4)
+    print(f"Best layout written to {args.output}, every chain written to {args.results}")
@@ -0,0 +1,63 @@
+from Key import Key
+
+# Left to right across the keyboard, a finger's index in here is its finger id
+FINGERS = list(Key.FINGER_RANGES)
+NO_FINGER = len(FINGERS)  # finger id for slots outside every finger's range
+FINGER_COUNT = NO_FINGER + 1
+FINGER_IDS = {finger: i for i, finger in enumerate(FINGERS)}
+
+# What each kind of trigram costs per occurrence, before trigram_weight
+# Alternation and rolls are what a good layout is made of so they're free by default,
+# same finger trigrams are already punished by the bigram score
+TRIGRAM_PENALTIES = {
+    "alternation": 0.0,  # hands go L R L or R L R
+    "roll": 0.0,  # 2 different fingers on one hand then the other hand (or the other way around)
+    "onehand": 1.0,  # all 3 on one hand moving in one direction
+    "redirect": 2.0,  # all 3 on one hand but changing direction halfway
+    "same_finger": 0.0,  # the same finger twice in a row
+}
+
+
+def finger_id(finger):
+    return FINGER_IDS.get(finger, NO_FINGER)
+
+
+def hand(finger_index):
+    return FINGERS[finger_index].split("_")[0]
+
+
+def classify_trigram(finger1, finger2, finger3):
+    """Which kind of trigram 3 finger ids make, None if any of them isn't typed by a finger"""
+    if NO_FINGER in (finger1, finger2, finger3):
+        return None
+    if finger1 == finger2 or finger2 == finger3:
+        return "same_finger"
+    hand1, hand2, hand3 = hand(finger1), hand(finger2), hand(finger3)
+    if hand1 != hand2 and hand2 != hand3:
+        return "alternation"
+    if hand1 != hand2 or hand2 != hand3:
+        return "roll"
+    if (finger2 - finger1 > 0) == (finger3 - finger2 > 0):
+        return "onehand"
+    return "redirect"
+
+
+def trigram_cost_table(penalties=None):
+    """Cost of every (finger1, finger2, finger3) as a flat list indexed by
+    (finger1 * FINGER_COUNT + finger2) * FINGER_COUNT + finger3,
+    so scoring a trigram is 3 slot lookups and one index instead of classifying it every time
+    """
+    if penalties is None:
+        penalties = TRIGRAM_PENALTIES
+    table = []
+    for finger1 in range(FINGER_COUNT):
+        for finger2 in range(FINGER_COUNT):
+            for finger3 in range(FINGER_COUNT):
+                kind = classify_trigram(finger1, finger2, finger3)
+                table.append(penalties.get(kind, 0.0) if kind else 0.0)
+    return table
+
+
+def trigram_index(finger1, finger2, finger3):
+    return (finger1 * FINGER_COUNT + finger2) * FINGER_COUNT + finger3
+
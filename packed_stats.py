@@ -0,0 +1,304 @@
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from collections.abc import Mapping
+
+from corpus_stats import CorpusStats
+
+MAGIC = b"KBSTATS\x01"
+PACKED_VERSION = 1
+PACKED_SUFFIX = ".kbstats"
+ALIGN = 8  # every table starts on an 8 byte boundary so it can be cast in place
+
+_worker_stats = None  # set once per worker process by init_worker
+
+
+class PackedTable(Mapping):
+    """Read-only Counter-like view of one n-gram table in a packed buffer.
+
+    Unigrams and bigrams are dense, the count of the n-gram with character ids (i, j) is at
+    i * size + j. Trigrams and skipgrams are sparse, codes holds the sorted dense index of
+    every n-gram that's there and counts the counts in the same order.
+    Like a Counter, a missing n-gram counts as 0 and keys are characters (unigrams) or tuples.
+    """
+
+    def __init__(self, alphabet, char_ids, order, counts, codes=None):
+        self.alphabet = alphabet
+        self.char_ids = char_ids
+        self.order = order
+        self.counts = counts
+        self.codes = codes
+        self._len = None
+
+    def code(self, key):
+        """Dense index of an n-gram, None if it has a character the corpus doesn't"""
+        if self.order == 1:
+            return self.char_ids.get(key)
+        if not isinstance(key, tuple) or len(key) != self.order:
+            return None
+        code = 0
+        for char in key:
+            char_id = self.char_ids.get(char)
+            if char_id is None:
+                return None
+            code = code * len(self.alphabet) + char_id
+        return code
+
+    def key(self, code):
+        if self.order == 1:
+            return self.alphabet[code]
+        chars = []
+        for _ in range(self.order):
+            code, char_id = divmod(code, len(self.alphabet))
+            chars.append(self.alphabet[char_id])
+        return tuple(reversed(chars))
+
+    def position(self, key):
+        code = self.code(key)
+        if code is None or self.codes is None:
+            return code
+        position = bisect_left(self.codes, code)
+        if position < len(self.codes) and self.codes[position] == code:
+            return position
+        return None
+
+    def __getitem__(self, key):
+        position = self.position(key)
+        return 0 if position is None else self.counts[position]
+
+    def get(self, key, default=None):
+        count = self[key]
+        return count if count else default
+
+    def __contains__(self, key):
+        return bool(self[key])
+
+    def items(self):
+        codes = self.codes
+        for position, count in enumerate(self.counts):
+            if count:
+                yield self.key(position if codes is None else codes[position]), count
+
+    def __iter__(self):
+        return (key for key, _ in self.items())
+
+    def values(self):
+        return (count for count in self.counts if count)
+
+    def __len__(self):
+        if self._len is None:
+            self._len = sum(1 for count in self.counts if count)
+        return self._len
+
+
+class PackedStats(CorpusStats):
+    """CorpusStats read straight out of a packed buffer (see pack_stats), no unpickling or
+    copying. The buffer can be a memory-mapped file (open_packed_stats) or a block of
+    shared memory (share_stats / attach_stats), so any number of processes can read the
+    same copy. The tables are read-only views, to_corpus_stats() gives back plain Counters
+    that can be counted into again.
+    """
+
+    def __init__(self, buffer, owner=None):
+        self.owner = owner  # the mmap or SharedMemory the buffer belongs to, kept open with it
+        view = memoryview(buffer)
+        if bytes(view[: len(MAGIC)]) != MAGIC:
+            raise ValueError("not a packed corpus stats buffer")
+        (header_size,) = struct.unpack_from("<Q", view, len(MAGIC))
+        start = len(MAGIC) + 8
+        header = json.loads(bytes(view[start : start + header_size]).decode("utf-8"))
+        if header["version"] != PACKED_VERSION:
+            raise ValueError(f"unsupported packed corpus stats version {header['version']}")
+        if header["byteorder"] != sys.byteorder:
+            raise ValueError("packed corpus stats were written on a machine with a different byte order")
+
+        self.header = header
+        self.alphabet = header["alphabet"]
+        self.char_ids = {char: i for i, char in enumerate(self.alphabet)}
+        self.count_trigrams = header["count_trigrams"]
+        self.ngram_limit = header["ngram_limit"]
+        typecode = header["typecode"]
+
+        def table_array(name, array_typecode=typecode):
+            offset, length = header["tables"][name]
+            return view[offset : offset + length * 8].cast(array_typecode)
+
+        def table(name, order, sparse=False):
+            codes = table_array(name + "_codes", "q") if sparse else None
+            return PackedTable(self.alphabet, self.char_ids, order, table_array(name), codes)
+
+        self.frequencies = table("frequencies", 1)
+        self.bigrams = table("bigrams", 2)
+        self.trigrams = table("trigrams", 3, sparse=True)
+        self.skipgrams = table("skipgrams", 2, sparse=True)
+
+    def to_corpus_stats(self):
+        """Plain Counter backed CorpusStats with the same counts"""
+        stats = CorpusStats(
+            Counter(dict(self.frequencies.items())),
+            Counter(dict(self.bigrams.items())),
+            count_trigrams=self.count_trigrams,
+            ngram_limit=self.ngram_limit,
+        )
+        stats.trigrams = Counter(dict(self.trigrams.items()))
+        stats.skipgrams = Counter(dict(self.skipgrams.items()))
+        return stats
+
+    def close(self):
+        """Closes the mmap or shared memory, the tables can't be read after this"""
+        self.frequencies = self.bigrams = self.trigrams = self.skipgrams = None
+        if self.owner is not None:
+            self.owner.close()
+            self.owner = None
+
+
+def _padded(data):
+    return data + b"\0" * (-len(data) % ALIGN)
+
+
+def pack_stats(stats):
+    """Packs a CorpusStats into bytes:
+        magic, header size, json header (alphabet, where each table is, count type)
+        unigrams: one count per character of the alphabet
+        bigrams: alphabet size x alphabet size counts
+        trigrams, skipgrams: sorted dense indexes and their counts (these are too sparse for dense)
+    Counts are 64 bit ints, or doubles if any of them isn't whole (mixed corpora).
+    """
+    tables = {
+        "frequencies": stats.frequencies,
+        "bigrams": stats.bigrams,
+        "trigrams": stats.trigrams,
+        "skipgrams": stats.skipgrams,
+    }
+    chars = set(stats.frequencies)
+    for name in ("bigrams", "trigrams", "skipgrams"):
+        for ngram in tables[name]:
+            chars.update(ngram)
+    alphabet = sorted(chars)
+    char_ids = {char: i for i, char in enumerate(alphabet)}
+    size = len(alphabet)
+    whole = all(
+        float(count).is_integer() for table in tables.values() for count in table.values()
+    )
+    typecode = "q" if whole else "d"
+    cast = int if whole else float
+
+    def dense_code(ngram):
+        code = 0
+        for char in ngram:
+            code = code * size + char_ids[char]
+        return code
+
+    arrays = {}
+    counts = [0] * size
+    for char, count in stats.frequencies.items():
+        counts[char_ids[char]] = cast(count)
+    arrays["frequencies"] = array(typecode, counts).tobytes()
+    counts = [0] * (size * size)
+    for bigram, count in stats.bigrams.items():
+        counts[dense_code(bigram)] = cast(count)
+    arrays["bigrams"] = array(typecode, counts).tobytes()
+    for name in ("trigrams", "skipgrams"):
+        rows = sorted((dense_code(ngram), cast(count)) for ngram, count in tables[name].items())
+        arrays[name + "_codes"] = array("q", (code for code, _ in rows)).tobytes()
+        arrays[name] = array(typecode, (count for _, count in rows)).tobytes()
+
+    header = {
+        "version": PACKED_VERSION,
+        "byteorder": sys.byteorder,
+        "alphabet": alphabet,
+        "typecode": typecode,
+        "count_trigrams": stats.count_trigrams,
+        "ngram_limit": stats.ngram_limit,
+        "tables": {},
+    }
+    # Table offsets depend on the header's size, which depends on the offsets, so the
+    # header is sized with placeholder offsets at least as long as the real ones
+    for name, data in arrays.items():
+        header["tables"][name] = [2**62, len(data) // 8]
+    offset = len(MAGIC) + 8 + len(_padded(json.dumps(header).encode("utf-8")))
+    for name, data in arrays.items():
+        header["tables"][name] = [offset, len(data) // 8]
+        offset += len(data)
+    header_bytes = json.dumps(header).encode("utf-8")
+    start = len(MAGIC) + 8 + len(header_bytes)
+    # Pad the header out to where the first table was placed
+    header_bytes += b" " * (header["tables"]["frequencies"][0] - start)
+    return b"".join(
+        [MAGIC, struct.pack("<Q", len(header_bytes)), header_bytes, *arrays.values()]
+    )
+
+
+def write_packed_stats(path, stats):
+    """Writes to a temp file first so a half written file is never picked up"""
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(pack_stats(stats))
+    os.replace(temp_path, path)
+
+
+def open_packed_stats(path):
+    """Memory-maps a file written by write_packed_stats, the OS shares its pages between
+    every process that opens it"""
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return PackedStats(mapped, mapped)
+
+
+def share_stats(stats):
+    """Packs stats into a new block of shared memory, returns the SharedMemory.
+    Hand its name to attach_stats in other processes, and close() and unlink() it once
+    they're all done."""
+    from multiprocessing import shared_memory  # only needed here, keeps importing this module cheap
+
+    data = pack_stats(stats)
+    shared = shared_memory.SharedMemory(create=True, size=len(data))
+    shared.buf[: len(data)] = data
+    return shared
+
+
+def attach_stats(name):
+    """PackedStats over shared memory made by share_stats, reads it in place"""
+    from multiprocessing import shared_memory
+
+    shared = shared_memory.SharedMemory(name=name)
+    return PackedStats(shared.buf, shared)
+
+
+def init_worker(shared_name):
+    """Pool initializer that attaches the stats a parent shared with share_stats, so every
+    worker reads them in place and nothing is pickled. worker_stats() hands them out."""
+    global _worker_stats
+    _worker_stats = attach_stats(shared_name)
+
+
+def worker_stats():
+    """The stats init_worker attached in this process"""
+    return _worker_stats
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from corpus_stats import load_corpus_stats
+
+    parser = argparse.ArgumentParser(
+        description="Count a corpus once and write its stats as a .kbstats file workers can memory-map"
+    )
+    parser.add_argument("corpus", help="text file or directory of source files")
+    parser.add_argument("--output", default=None, help="defaults to the corpus name + .kbstats")
+    parser.add_argument("--trigrams", action="store_true", help="also count trigrams and skipgrams")
+    parser.add_argument("--ngram-limit", type=int, default=None)
+    args = parser.parse_args()
+
+    stats = load_corpus_stats(
+        args.corpus, count_trigrams=args.trigrams, ngram_limit=args.ngram_limit
+    )
+    output = args.output or os.path.splitext(args.corpus.rstrip("/\\"))[0] + PACKED_SUFFIX
+    write_packed_stats(output, stats)
+    print(f"{len(stats.frequencies)} characters, {len(stats.bigrams)} bigrams written to {output}")
@@ -0,0 +1,273 @@
+import argparse
+import json
+import math
+import random
+import time
+from multiprocessing import Pipe, Process
+
+import Project
+from Project import anneal, make_scorer, metropolis_step, score
+from corpus_stats import load_corpus_stats
+from layout_state import LayoutState
+from moves import MoveGenerator
+from multi_start import build_starting_layout
+from packed_stats import attach_stats, share_stats
+from schedules import estimate_start_temperature
+
+
+def temperature_ladder(coldest=1.0, hottest=1000.0, replicas=8):
+    """Geometrically spaced temperatures, coldest first"""
+    if replicas == 1:
+        return [coldest]
+    ratio = (hottest / coldest) ** (1 / (replicas - 1))
+    return [coldest * ratio**i for i in range(replicas)]
+
+
+def ladder_bounds(corpus, start="dvorak", allow_shift_layer_swaps=True, seed=0):
+    """Coldest and hottest temperatures for a corpus, score deltas grow with its size so
+    fixed ones only suit some corpora. Sampled from the starting layout's moves: the hottest
+    accepts an average worsening move 80% of the time, the coldest 1%."""
+    layout = build_starting_layout(start, corpus, random.Random(seed), allow_shift_layer_swaps)
+    random.seed(seed)
+    hottest = estimate_start_temperature(
+        make_scorer(layout), MoveGenerator(layout, allow_shift_layer_swaps), acceptance=0.8
+    )
+    return hottest * math.log(0.8) / math.log(0.01), hottest
+
+
+def should_exchange(score1, temperature1, score2, temperature2, rng):
+    """Replica exchange criterion, accept with probability min(1, exp((1/T1 - 1/T2) * (E1 - E2)))"""
+    delta = (1 / temperature1 - 1 / temperature2) * (score1 - score2)
+    return delta >= 0 or rng.random() < math.exp(delta)
+
+
+def _replica_worker(conn, shared_name, start, seed, allow_shift_layer_swaps):
+    """Owns one replica's layout, runs Metropolis steps at whatever temperature it's told.
+    Exchanges swap temperatures between workers rather than layouts so nothing big is ever sent.
+    The corpus stats are read in place from the shared memory replica_exchange made.
+    """
+    corpus = attach_stats(shared_name)
+    layout = build_starting_layout(
+        start, corpus, random.Random(seed), allow_shift_layer_swaps
+    )
+    scorer = make_scorer(layout)
+    moves = MoveGenerator(layout, allow_shift_layer_swaps)
+    random.seed(seed)
+    best_score = scorer.score
+    best_state = LayoutState.from_layout(layout)
+
+    while True:
+        command = conn.recv()
+        if command[0] == "run":
+            _, temperature, steps = command
+            accepted_moves = 0
+            for _ in range(steps):
+                accepted, _, _, _ = metropolis_step(scorer, moves, temperature)
+                if accepted:
+                    accepted_moves += 1
+                    if scorer.score < best_score:
+                        best_score = scorer.score
+                        best_state.capture(layout)
+            conn.send((scorer.score, best_score, accepted_moves))
+        elif command[0] == "best":
+            conn.send((best_score, best_state.to_json()))
+        else:
+            break
+    conn.close()
+    corpus.close()
+
+
+def replica_exchange(
+    corpus,
+    temperatures=None,
+    rounds=200,
+    steps_per_round=100,
+    start="dvorak",
+    seed=None,
+    allow_shift_layer_swaps=True,
+    replicas=8,
+):
+    """Parallel tempering: one replica per temperature, each in its own process.
+    Every round each replica runs steps_per_round Metropolis steps at its temperature,
+    then neighbouring temperatures try to exchange (even pairs on even rounds, odd on odd).
+    Without temperatures, replicas of them are spread between ladder_bounds() for the corpus.
+    Returns the best layout seen by any replica along with exchange statistics.
+    """
+    if seed is None:
+        seed = random.SystemRandom().randrange(2**32)
+    if temperatures is None:
+        coldest, hottest = ladder_bounds(corpus, start, allow_shift_layer_swaps, seed)
+        temperatures = temperature_ladder(coldest, hottest, replicas)
+    rng = random.Random(seed)
+    started = time.perf_counter()
+
+    # Every replica reads the one copy in shared memory instead of unpickling its own
+    shared = share_stats(corpus)
+    connections = []
+    processes = []
+    # replica_at[level] is the replica currently running at temperatures[level]
+    replica_at = list(range(len(temperatures)))
+    exchange_attempts = [0] * (len(temperatures) - 1)
+    exchange_accepts = [0] * (len(temperatures) - 1)
+    accepted_moves = [0] * len(temperatures)
+    scores = [0.0] * len(temperatures)
+
+    try:
+        for i in range(len(temperatures)):
+            parent_conn, child_conn = Pipe()
+            process = Process(
+                target=_replica_worker,
+                args=(child_conn, shared.name, start, seed + i + 1, allow_shift_layer_swaps),
+            )
+            process.start()
+            connections.append(parent_conn)
+            processes.append(process)
+
+        for round_number in range(rounds):
+            for level, replica in enumerate(replica_at):
+                connections[replica].send(("run", temperatures[level], steps_per_round))
+            for replica, conn in enumerate(connections):
+                scores[replica], _, accepted = conn.recv()
+                accepted_moves[replica] += accepted
+
+            for level in range(round_number % 2, len(temperatures) - 1, 2):
+                cold = replica_at[level]
+                hot = replica_at[level + 1]
+                exchange_attempts[level] += 1
+                if should_exchange(
+                    scores[cold],
+                    temperatures[level],
+                    scores[hot],
+                    temperatures[level + 1],
+                    rng,
+                ):
+                    exchange_accepts[level] += 1
+                    replica_at[level], replica_at[level + 1] = hot, cold
+
+        best_scores = []
+        for conn in connections:
+            conn.send(("best",))
+            best_scores.append(conn.recv())
+    finally:
+        for conn in connections:
+            conn.send(("stop",))
+        for process in processes:
+            process.join()
+        shared.close()
+        shared.unlink()
+
+    best_score, best_layout = min(best_scores, key=lambda best: best[0])
+    steps = rounds * steps_per_round
+    return {
+        "seed": seed,
+        "best_score": best_score,
+        "layout": best_layout,
+        "temperatures": temperatures,
+        "exchange_rates": [
+            accepts / attempts if attempts else 0.0
+            for accepts, attempts in zip(exchange_accepts, exchange_attempts)
+        ],
+        "replicas": [
+            {
+                "replica": replica,
+                "best_score": best_scores[replica][0],
+                "acceptance_rate": accepted_moves[replica] / steps,
+            }
+            for replica in range(len(temperatures))
+        ],
+        "steps_per_replica": steps,
+        "seconds": time.perf_counter() - started,
+    }
+
+
+def benchmark_against_annealing(corpus, seed=400, **replica_options):
+    """Runs plain anneal() and replica exchange on the same corpus and start, for comparing"""
+    start = replica_options.get("start", "dvorak")
+    layout = build_starting_layout(
+        start,
+        corpus,
+        random.Random(seed),
+        replica_options.get("allow_shift_layer_swaps", True),
+    )
+    random.seed(seed)
+    started = time.perf_counter()
+    best_layout, _, _, _, _ = anneal(
+        Project.temperature,
+        Project.cooling_rate,
+        layout,
+        replica_options.get("allow_shift_layer_swaps", True),
+        show_progress=False,
+    )
+    annealing = {
+        "best_score": score(best_layout),
+        "steps": Project.iterations,
+        "seconds": time.perf_counter() - started,
+    }
+    tempering = replica_exchange(corpus, seed=seed, **replica_options)
+    return {"annealing": annealing, "replica_exchange": tempering}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Replica exchange (parallel tempering) optimizer, one process per temperature"
+    )
+    parser.add_argument("--corpus", default=Project.corpus_file)
+    parser.add_argument("--start", default="dvorak")
+    parser.add_argument("--replicas", type=int, default=8)
+    parser.add_argument(
+        "--coldest", type=float, default=None, help="fitted to the corpus' score changes by default"
+    )
+    parser.add_argument(
+        "--hottest", type=float, default=None, help="fitted to the corpus' score changes by default"
+    )
+    parser.add_argument("--rounds", type=int, default=200)
+    parser.add_argument("--steps-per-round", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--output", default="best_annealed_layout.json")
+    parser.add_argument(
+        "--compare",
+        action="store_true",
+        help="also run plain annealing on the same corpus and report both",
+    )
+    args = parser.parse_args()
+
+    corpus = load_corpus_stats(args.corpus)
+    temperatures = None
+    if args.coldest is not None or args.hottest is not None:
+        coldest, hottest = args.coldest, args.hottest
+        if coldest is None or hottest is None:
+            fitted = ladder_bounds(corpus, args.start)
+            coldest = fitted[0] if coldest is None else coldest
+            hottest = fitted[1] if hottest is None else hottest
+        temperatures = temperature_ladder(coldest, hottest, args.replicas)
+    options = dict(
+        temperatures=temperatures,
+        replicas=args.replicas,
+        rounds=args.rounds,
+        steps_per_round=args.steps_per_round,
+        start=args.start,
+    )
+    if args.compare:
+        seed = args.seed if args.seed is not None else 400
+        results = benchmark_against_annealing(corpus, seed=seed, **options)
+        annealing = results["annealing"]
+        tempering = results["replica_exchange"]
+        print(
+            f"Annealing:        {annealing['best_score']:.2f} in {annealing['seconds']:.2f}s "
+            f"({annealing['steps']} steps)"
+        )
+        print(
+            f"Replica exchange: {tempering['best_score']:.2f} in {tempering['seconds']:.2f}s "
+            f"({tempering['steps_per_replica']} steps x {args.replicas} replicas)"
+        )
+    else:
+        tempering = replica_exchange(corpus, seed=args.seed, **options)
+        print(f"Best Layout Score: {tempering['best_score']:.2f} | Seed: {tempering['seed']}")
+
+    ladder = ", ".join(f"{temperature:.3g}" for temperature in tempering["temperatures"])
+    print(f"Temperatures: {ladder}")
+    rates = ", ".join(f"{rate:.2f}" for rate in tempering["exchange_rates"])
+    print(f"Exchange acceptance between neighbouring temperatures: {rates}")
+    with open(args.output, "w") as f:
+        json.dump(tempering["layout"], f, indent=4)
+    print(f"Layout successfully written to {args.output}")
@@ -0,0 +1,66 @@
+from incremental_scorer import moved_by_cycle_keys, moved_by_swap_keys, moved_by_swap_shifts
+
+# Scorer methods for each kind of move, by the name neighbourhood() gives it
+DELTAS = {
+    "keys": "delta_swap_keys",
+    "shifts": "delta_swap_shifts",
+    "cycle": "delta_cycle_keys",
+}
+APPLIES = {
+    "keys": "apply_swap_keys",
+    "shifts": "apply_swap_shifts",
+    "cycle": "apply_cycle_keys",
+}
+
+
+def neighbourhood(layout, moves, cycles=False):
+    """Every legal move from the layout as it is right now as (kind, keys, moved), moved
+    being which characters it moves and where. moves is a moves.MoveGenerator, cycles also
+    adds every 3-cycle of movable keys (about 30 times as many moves as the swaps)"""
+    char_locations = layout.char_locations
+    candidates = [
+        ("keys", keys, moved_by_swap_keys(char_locations, *keys)) for keys in moves.base_swaps()
+    ]
+    candidates += [
+        ("shifts", keys, moved_by_swap_shifts(char_locations, *keys))
+        for keys in moves.shift_swaps()
+    ]
+    if cycles:
+        candidates += [
+            ("cycle", keys, moved_by_cycle_keys(char_locations, *keys))
+            for keys in moves.base_cycles()
+        ]
+    return [candidate for candidate in candidates if candidate[2]]
+
+
+def polish(scorer, moves, cycles=False, max_moves=None):
+    """Steepest descent from wherever the scorer's layout is: scores every legal move,
+    applies the best one and repeats until nothing improves, so the layout ends up at a
+    local optimum of the neighbourhood annealing only ever sampled.
+    A scorer with batch_delta (VectorizedScorer) scores each scan in one go, otherwise it's
+    one delta per move. Returns the scores before and after and how many moves were applied.
+    """
+    starting_score = scorer.score
+    applied = 0
+    while max_moves is None or applied < max_moves:
+        candidates = neighbourhood(scorer.layout, moves, cycles)
+        if not candidates:
+            break
+        if hasattr(scorer, "batch_delta"):
+            deltas = scorer.batch_delta([moved for _, _, moved in candidates]).tolist()
+        else:
+            deltas = [getattr(scorer, DELTAS[kind])(*keys) for kind, keys, _ in candidates]
+        best = min(range(len(deltas)), key=deltas.__getitem__)
+        # Anything smaller is rounding, stopping there keeps it from going back and forth
+        if deltas[best] >= -1e-9 * abs(scorer.score):
+            break
+        kind, keys, _ = candidates[best]
+        getattr(scorer, APPLIES[kind])(*keys)
+        applied += 1
+
+    return {
+        "starting_score": starting_score,
+        "score": scorer.score,
+        "moves": applied,
+        "improvement": (starting_score - scorer.score) / starting_score * 100,
+    }
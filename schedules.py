@@ -0,0 +1,225 @@
+import math
+import time
+
+
+def estimate_start_temperature(scorer, moves, samples=500, acceptance=0.8):
+    """Picks a starting temperature from the moves themselves instead of guessing 2**40.
+    Samples random swaps (without applying them) and returns the temperature at which an
+    average worsening move would be accepted with the given probability.
+    """
+    worse = []
+    for _ in range(samples):
+        key1, key2, shifts = moves.propose()
+        if shifts:
+            delta = scorer.delta_swap_shifts(key1, key2)
+        else:
+            delta = scorer.delta_swap_keys(key1, key2)
+        if delta > 0:
+            worse.append(delta)
+    if not worse:
+        return 1.0
+    return -(sum(worse) / len(worse)) / math.log(acceptance)
+
+
+class Schedule:
+    """Base cooling schedule, anneal() calls start() once, then for every iteration reads
+    temperature, checks done() and reports back through update().
+
+    Shared options:
+        temperature: starting temperature, None estimates it from sampled moves
+        seconds / evaluations: budget, the run stops once either is used up
+        reheat_after: iterations without a new best before the temperature is raised again
+        reheat_factor: how much a reheat multiplies the temperature by
+        stop_after: iterations without a new best before giving up
+    """
+
+    check_every = 1000  # iterations between looking at the clock
+
+    def __init__(
+        self,
+        temperature=None,
+        seconds=None,
+        evaluations=None,
+        reheat_after=None,
+        reheat_factor=10.0,
+        stop_after=None,
+    ):
+        self.start_temperature = temperature
+        self.temperature = temperature
+        self.seconds = seconds
+        self.evaluations = evaluations
+        self.reheat_after = reheat_after
+        self.reheat_factor = reheat_factor
+        self.stop_after = stop_after
+
+    def start(self, scorer, moves):
+        if self.start_temperature is None:
+            self.start_temperature = estimate_start_temperature(scorer, moves)
+        self.temperature = self.start_temperature
+        self.iteration = 0
+        self.since_best = 0
+        self.reheats = 0
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def state(self):
+        """Everything set since start(), for checkpoints. The clock is saved as time
+        already spent so a resumed run picks its time budget up where it left off"""
+        state = dict(vars(self))
+        state["started"] = time.perf_counter() - self.started
+        return state
+
+    def restore(self, state):
+        """Puts a schedule back how state() found it, instead of calling start()"""
+        vars(self).update(state)
+        self.started = time.perf_counter() - state["started"]
+
+    def progress(self):
+        """How far through the run we are, 0 to 1"""
+        fractions = []
+        if self.seconds:
+            fractions.append(self.elapsed / self.seconds)
+        if self.evaluations:
+            fractions.append(self.iteration / self.evaluations)
+        return min(1.0, max(fractions, default=0.0))
+
+    def done(self):
+        if self.stop_after is not None and self.since_best >= self.stop_after:
+            return True
+        return bool(self.seconds or self.evaluations) and self.progress() >= 1
+
+    def update(self, accepted, improved):
+        """Called after every iteration with whether the move was accepted and made a new best"""
+        self.iteration += 1
+        if self.iteration % self.check_every == 0:
+            if self.seconds:
+                self.elapsed = time.perf_counter() - self.started
+            self.on_check()
+        if improved:
+            self.since_best = 0
+        else:
+            self.since_best += 1
+        self.cool(accepted)
+        if self.reheat_after is not None and self.since_best >= self.reheat_after:
+            if self.since_best % self.reheat_after == 0:
+                self.temperature *= self.reheat_factor
+                self.reheats += 1
+
+    def on_check(self):
+        """Called every check_every iterations, after the clock has been read if there's a time budget"""
+
+    def cool(self, accepted):
+        raise NotImplementedError
+
+
+class GeometricSchedule(Schedule):
+    """The original schedule, temperature *= cooling_rate until it drops to final_temperature"""
+
+    def __init__(self, temperature, cooling_rate, final_temperature=1, **options):
+        super().__init__(temperature, **options)
+        self.cooling_rate = cooling_rate
+        self.final_temperature = final_temperature
+
+    def iterations(self):
+        """How many iterations it'll take to cool all the way down"""
+        return math.ceil(
+            math.log(self.final_temperature / self.start_temperature)
+            / math.log(self.cooling_rate)
+        )
+
+    def progress(self):
+        if self.seconds or self.evaluations:
+            return super().progress()
+        return min(1.0, self.iteration / max(1, self.iterations()))
+
+    def done(self):
+        return self.temperature <= self.final_temperature or super().done()
+
+    def cool(self, accepted):
+        self.temperature *= self.cooling_rate
+
+
+class BudgetSchedule(Schedule):
+    """Cools geometrically from the starting temperature to final_temperature over a fixed
+    wall-clock (seconds) or evaluation budget. With a time budget the cooling rate is
+    recomputed from the measured iterations per second, so the run ends on time whatever
+    the corpus.
+    """
+
+    def __init__(self, temperature=None, final_temperature=1, **options):
+        super().__init__(temperature, **options)
+        self.final_temperature = final_temperature
+
+    def start(self, scorer, moves):
+        super().start(scorer, moves)
+        if self.evaluations:
+            self.cooling_rate = self.rate_for(self.evaluations)
+        else:
+            # Until the clock has been read once, assume a slow-ish 10,000 iterations per second
+            self.cooling_rate = self.rate_for(max(1, int(self.seconds * 10000)))
+
+    def rate_for(self, remaining_iterations):
+        """Cooling rate that takes the current temperature to final_temperature in that many iterations"""
+        if self.temperature <= self.final_temperature:
+            return 1.0
+        return (self.final_temperature / self.temperature) ** (1 / remaining_iterations)
+
+    def on_check(self):
+        """Recomputes the cooling rate for what's left of the budget, this also gets a reheated
+        run back on track to finish at final_temperature"""
+        remaining = []
+        if self.seconds:
+            throughput = self.iteration / max(self.elapsed, 1e-9)
+            remaining.append(int((self.seconds - self.elapsed) * throughput))
+        if self.evaluations:
+            remaining.append(self.evaluations - self.iteration)
+        self.cooling_rate = self.rate_for(max(1, min(remaining)))
+
+    def cool(self, accepted):
+        self.temperature *= self.cooling_rate
+
+
+class AdaptiveSchedule(Schedule):
+    """Steers the temperature so the acceptance rate follows a target that falls from
+    target_start to target_end over the run. Every window iterations the temperature is
+    lowered if too many moves were accepted and raised if too few.
+    Needs a seconds or evaluations budget to know how far through the run it is.
+    """
+
+    def __init__(
+        self,
+        temperature=None,
+        target_start=0.5,
+        target_end=0.001,
+        window=500,
+        adjust=1.1,
+        **options,
+    ):
+        if options.get("evaluations") is None and not options.get("seconds"):
+            options["evaluations"] = 200000
+        super().__init__(temperature, **options)
+        self.target_start = target_start
+        self.target_end = target_end
+        self.window = window
+        self.adjust = adjust
+
+    def start(self, scorer, moves):
+        super().start(scorer, moves)
+        self.accepted_in_window = 0
+        self.acceptance_rate = None
+
+    def target(self):
+        """Acceptance rate we're aiming for right now, falls geometrically over the run"""
+        return self.target_start * (self.target_end / self.target_start) ** self.progress()
+
+    def cool(self, accepted):
+        if accepted:
+            self.accepted_in_window += 1
+        if self.iteration % self.window:
+            return
+        self.acceptance_rate = self.accepted_in_window / self.window
+        self.accepted_in_window = 0
+        if self.acceptance_rate > self.target():
+            self.temperature /= self.adjust
+        else:
+            self.temperature *= self.adjust
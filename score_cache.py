@@ -0,0 +1,138 @@
+import random
+from collections import OrderedDict
+
+from incremental_scorer import moved_by_swap_keys, moved_by_swap_shifts
+
+# Rough size of one entry (int key, float value and the OrderedDict's bookkeeping),
+# used to turn max_megabytes into a number of entries
+BYTES_PER_ENTRY = 170
+
+
+class ScoreCache:
+    """LRU cache of layout scores keyed by a Zobrist hash of the layout.
+
+    Every (character, location) pair gets a random 64 bit number and a layout's hash is the
+    XOR of the numbers for where each of its characters is. A swap only moves a few
+    characters, so the hash of the layout it leads to is a couple of XORs away from the
+    current one, no need to look at the whole layout.
+
+    One cache can be shared by several runs as long as they use the same corpus and weights.
+    """
+
+    def __init__(self, max_megabytes=64, seed=0):
+        self.max_entries = max(1, int(max_megabytes * 1024 * 1024 / BYTES_PER_ENTRY))
+        self.entries = OrderedDict()
+        self.zobrist = {}
+        self.rng = random.Random(seed)  # its own, drawing from random would change the run
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, char, loc):
+        number = self.zobrist.get((char, loc))
+        if number is None:
+            number = self.zobrist[(char, loc)] = self.rng.getrandbits(64)
+        return number
+
+    def hash_layout(self, char_locations):
+        layout_hash = 0
+        for char, loc in char_locations.items():
+            layout_hash ^= self.key(char, loc)
+        return layout_hash
+
+    def get(self, layout_hash):
+        score = self.entries.get(layout_hash)
+        if score is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(layout_hash)
+        return score
+
+    def put(self, layout_hash, score):
+        self.entries[layout_hash] = score
+        self.entries.move_to_end(layout_hash)
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+            "evictions": self.evictions,
+        }
+
+    def report(self):
+        stats = self.stats()
+        return (
+            f"Score cache: {stats['hit_rate'] * 100:.1f}% hits "
+            f"({stats['hits']} hits, {stats['misses']} misses), "
+            f"{stats['entries']}/{stats['max_entries']} entries, {stats['evictions']} evicted"
+        )
+
+
+class CachedScorer:
+    """Wraps an IncrementalScorer or VectorizedScorer, same interface. A proposed swap is
+    looked up by the hash of the layout it would lead to before the scorer computes it,
+    and the layout hash is kept up to date on every swap that's applied.
+
+    A hit returns the score from when that layout was last seen, which can differ from the
+    running total in the last few digits, so a cached run isn't bit-for-bit the same as an
+    uncached one.
+    """
+
+    def __init__(self, scorer, cache):
+        self.scorer = scorer
+        self.cache = cache
+        self.layout = scorer.layout
+        self.char_locations = scorer.layout.char_locations
+        self.hash = cache.hash_layout(self.char_locations)
+        cache.put(self.hash, scorer.score)
+
+    @property
+    def score(self):
+        return self.scorer.score
+
+    def hash_after(self, moved):
+        layout_hash = self.hash
+        for char, loc in moved.items():
+            layout_hash ^= self.cache.key(char, self.char_locations[char]) ^ self.cache.key(
+                char, loc
+            )
+        return layout_hash
+
+    def _delta(self, moved, delta_swap, key1, key2):
+        if not moved:
+            return 0
+        layout_hash = self.hash_after(moved)
+        score = self.cache.get(layout_hash)
+        if score is not None:
+            return score - self.scorer.score
+        delta = delta_swap(key1, key2)
+        self.cache.put(layout_hash, self.scorer.score + delta)
+        return delta
+
+    def delta_swap_keys(self, key1, key2):
+        moved = moved_by_swap_keys(self.char_locations, key1, key2)
+        return self._delta(moved, self.scorer.delta_swap_keys, key1, key2)
+
+    def delta_swap_shifts(self, key1, key2):
+        moved = moved_by_swap_shifts(self.char_locations, key1, key2)
+        return self._delta(moved, self.scorer.delta_swap_shifts, key1, key2)
+
+    def apply_swap_keys(self, key1, key2):
+        moved = moved_by_swap_keys(self.char_locations, key1, key2)
+        if moved:
+            self.hash = self.hash_after(moved)
+        self.scorer.apply_swap_keys(key1, key2)
+
+    def apply_swap_shifts(self, key1, key2):
+        moved = moved_by_swap_shifts(self.char_locations, key1, key2)
+        if moved:
+            self.hash = self.hash_after(moved)
+        self.scorer.apply_swap_shifts(key1, key2)
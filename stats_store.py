@@ -0,0 +1,237 @@
+import hashlib
+import json
+import os
+
+from corpus_stats import (
+    CACHE_VERSION,
+    CorpusStats,
+    count_files,
+    hash_file,
+    list_corpus_files,
+    read_cache,
+    write_cache,
+)
+
+MANIFEST = "manifest.json"
+MANIFEST_VERSION = 2
+
+
+class StatsStore:
+    """Corpus stats kept per source file so a growing corpus never has to be recounted.
+
+    A store is a directory holding:
+        manifest.json: every source file that's included, with its size, mtime, sha256
+            and where its counts are
+        files/: the counts of each source file on its own
+        total-N.json.gz: all of them added up, what the optimizer reads
+    Adding a file adds its counts to the total, removing one subtracts them back out, and
+    refresh() only counts files that are new or have changed since the last time.
+    Counts are kept unpruned so subtracting is exact, ngram_limit is applied by total().
+
+    Nothing the saved manifest points at is changed before save() replaces it: new counts
+    go to files named after the generation being written and the ones they replace are
+    deleted after, so a refresh that's interrupted leaves the last saved store as it was.
+    """
+
+    def __init__(self, path, count_trigrams=False):
+        self.path = path
+        self.manifest = {"version": MANIFEST_VERSION, "count_trigrams": count_trigrams, "files": {}}
+        self.stats = CorpusStats(count_trigrams=count_trigrams)
+        self.dirty = False  # whether there's anything save() hasn't written yet
+        manifest_path = os.path.join(path, MANIFEST)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            total = read_cache(os.path.join(path, manifest.get("total", "")))
+            usable = (
+                manifest.get("version") == MANIFEST_VERSION
+                and total is not None
+                and (manifest["count_trigrams"] or not count_trigrams)
+            )
+            if usable:
+                self.manifest = manifest
+                self.stats = CorpusStats.from_json(total)
+            else:
+                print(f"Stats in {path} are from an older version or lack trigrams, recounting")
+
+    @property
+    def files(self):
+        return self.manifest["files"]
+
+    @property
+    def count_trigrams(self):
+        return self.manifest["count_trigrams"]
+
+    def file_stats_name(self, source):
+        """Where new counts for a source file go, relative to the store. Named after the
+        generation the next save() writes so they never overwrite saved ones."""
+        name = hashlib.sha1(source.encode("utf-8")).hexdigest()[:16]
+        generation = self.manifest.get("generation", 0) + 1
+        return f"files/{name}-{generation}.json.gz"
+
+    def file_stats(self, source):
+        """The counts stored for one included source file, None if they've gone missing"""
+        cached = read_cache(os.path.join(self.path, self.files[source]["stats"]))
+        return None if cached is None else CorpusStats.from_json(cached)
+
+    def add(self, paths, workers=None):
+        """Counts files into the store, a file that's already in it is recounted"""
+        paths = [os.path.abspath(path) for path in paths]
+        for path in paths:
+            if not os.path.isfile(path):
+                print(f"Skipping file that doesn't exist: {path}")
+        paths = [path for path in paths if os.path.isfile(path)]
+        self.remove([path for path in paths if path in self.files], workers)
+        for path, stats in count_files(paths, workers, count_trigrams=self.count_trigrams):
+            file_stat = os.stat(path)
+            name = self.file_stats_name(path)
+            write_cache(os.path.join(self.path, name), {"version": CACHE_VERSION}, stats)
+            self.files[path] = {
+                "size": file_stat.st_size,
+                "mtime_ns": file_stat.st_mtime_ns,
+                "sha256": hash_file(path),
+                "stats": name,
+            }
+            self.stats.update(stats)
+            self.dirty = True
+
+    def remove(self, paths, workers=None):
+        """Takes files' counts back out of the store. If any of their counts have gone
+        missing there's nothing to subtract, so everything else is recounted instead."""
+        paths = [path for path in map(os.path.abspath, paths) if path in self.files]
+        counts = [self.file_stats(path) for path in paths]
+        if any(stats is None for stats in counts):
+            for path in paths:
+                del self.files[path]
+            self.recount(workers)
+            return
+        for path, stats in zip(paths, counts):
+            self.stats.subtract(stats)
+            del self.files[path]
+            self.dirty = True
+
+    def recount(self, workers=None):
+        """Starts the total over and counts every included file that's still there"""
+        print(f"Stats in {self.path} are missing per file counts, recounting")
+        paths = [path for path in self.files if os.path.isfile(path)]
+        self.files.clear()
+        self.stats = CorpusStats(count_trigrams=self.count_trigrams)
+        self.dirty = True
+        self.add(paths, workers)
+
+    def changed(self, path):
+        """Whether a source file differs from when it was counted, the hash settles it when
+        the size or mtime changed. A file that was only touched gets its mtime refreshed."""
+        entry = self.files[path]
+        file_stat = os.stat(path)
+        if entry["size"] == file_stat.st_size and entry["mtime_ns"] == file_stat.st_mtime_ns:
+            return False
+        if entry["size"] == file_stat.st_size and entry["sha256"] == hash_file(path):
+            entry["mtime_ns"] = file_stat.st_mtime_ns
+            self.dirty = True
+            return False
+        return True
+
+    def refresh(self, input_directory, workers=None):
+        """Brings the store in line with a directory of source files: drops files that are
+        gone, recounts ones that changed and counts new ones. Returns how many of each."""
+        paths = [os.path.abspath(path) for path in list_corpus_files(input_directory)]
+        present = set(paths)
+        removed = [path for path in self.files if path not in present]
+        changed = [path for path in paths if path in self.files and self.changed(path)]
+        added = [path for path in paths if path not in self.files]
+        self.remove(removed + changed, workers)
+        self.add(changed + added, workers)
+        return {"added": len(added), "changed": len(changed), "removed": len(removed)}
+
+    def save(self):
+        """Writes the total under a new name before pointing the manifest at it, so a store
+        that's interrupted halfway still has a total that matches its manifest"""
+        os.makedirs(self.path, exist_ok=True)
+        old_total = self.manifest.get("total")
+        generation = self.manifest.get("generation", 0) + 1
+        total = f"total-{generation}.json.gz"
+        write_cache(os.path.join(self.path, total), {"version": CACHE_VERSION}, self.stats)
+        self.manifest["total"] = total
+        self.manifest["generation"] = generation
+        manifest_path = os.path.join(self.path, MANIFEST)
+        with open(manifest_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, indent=4)
+        os.replace(manifest_path + ".tmp", manifest_path)
+        self.dirty = False
+        # Only now that the manifest doesn't point at them can replaced counts go, along
+        # with any a run that was interrupted left behind
+        used = {entry["stats"] for entry in self.files.values()}
+        files_dir = os.path.join(self.path, "files")
+        if os.path.isdir(files_dir):
+            for name in os.listdir(files_dir):
+                if f"files/{name}" not in used:
+                    os.remove(os.path.join(files_dir, name))
+        if old_total and old_total != total:
+            try:
+                os.remove(os.path.join(self.path, old_total))
+            except FileNotFoundError:
+                pass
+
+    def total(self, ngram_limit=None):
+        """Everything in the store added up, trigrams/skipgrams cut to ngram_limit"""
+        if ngram_limit is None:
+            return self.stats
+        stats = self.stats.copy()
+        stats.ngram_limit = ngram_limit
+        return stats.prune(top_n=ngram_limit)
+
+
+def refresh_store(input_directory, store_path, workers=None, count_trigrams=False, ngram_limit=None):
+    """Refreshes (or creates) the store for a directory of source files and returns its
+    total, only new and changed files are counted"""
+    store = StatsStore(store_path, count_trigrams)
+    changes = store.refresh(input_directory, workers)
+    if store.dirty or not os.path.exists(os.path.join(store_path, MANIFEST)):
+        store.save()
+        print(
+            f"Corpus stats for {input_directory}: {changes['added']} files added, "
+            f"{changes['changed']} changed, {changes['removed']} removed"
+        )
+    return store.total(ngram_limit)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Keep corpus stats per source file, so adding or dropping files doesn't recount everything"
+    )
+    parser.add_argument("store", help="directory the stats are kept in")
+    parser.add_argument("--trigrams", action="store_true", help="also count trigrams and skipgrams")
+    parser.add_argument("--workers", type=int, default=None)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("refresh", help="sync with a directory of source files").add_argument(
+        "directory"
+    )
+    commands.add_parser("add", help="count files into the store").add_argument("files", nargs="+")
+    commands.add_parser("remove", help="take files back out").add_argument("files", nargs="+")
+    commands.add_parser("list", help="show what's included")
+    export = commands.add_parser("export", help="write the total as a .kbstats file")
+    export.add_argument("output")
+    export.add_argument("--ngram-limit", type=int, default=None)
+    args = parser.parse_args()
+
+    store = StatsStore(args.store, args.trigrams)
+    if args.command == "refresh":
+        print(store.refresh(args.directory, args.workers))
+        store.save()
+    elif args.command == "add":
+        store.add(args.files, args.workers)
+        store.save()
+    elif args.command == "remove":
+        store.remove(args.files, args.workers)
+        store.save()
+    elif args.command == "list":
+        for path, entry in sorted(store.files.items()):
+            print(f"{entry['size']:>12}  {path}")
+        print(f"{len(store.files)} files, {sum(store.stats.frequencies.values())} characters")
+    else:
+        from packed_stats import write_packed_stats
+
+        write_packed_stats(args.output, store.total(args.ngram_limit))
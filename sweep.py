@@ -0,0 +1,301 @@
+import argparse
+import itertools
+import json
+import os
+import random
+import time
+from multiprocessing import Pool
+
+import Project
+from Project import STARTING_LAYOUTS, KeyboardLayout, anneal, make_scorer
+from batch_scoring import COMPONENTS, BatchScorer
+from corpus_stats import load_corpus_stats
+from moves import MoveGenerator
+from packed_stats import init_worker, share_stats, worker_stats
+from polish import polish
+from schedules import BudgetSchedule
+
+# The Project globals a sweep can vary, everything else keeps its value from Project.py
+PARAMETERS = (
+    "home_row_balance_factor",
+    "finger_balance_factor",
+    "bigram_balance_factor",
+    "same_finger_penalty",
+    "same_hand_penalty",
+)
+
+
+def parse_values(spec):
+    """"name=1,2,3" -> (name, [1.0, 2.0, 3.0])"""
+    name, _, values = spec.partition("=")
+    if name not in PARAMETERS:
+        raise ValueError(f"unknown parameter {name}, pick from {', '.join(PARAMETERS)}")
+    return name, [float(value) for value in values.split(",")]
+
+
+def parse_range(spec):
+    """"name=low:high" -> (name, (low, high))"""
+    name, _, bounds = spec.partition("=")
+    if name not in PARAMETERS:
+        raise ValueError(f"unknown parameter {name}, pick from {', '.join(PARAMETERS)}")
+    low, _, high = bounds.partition(":")
+    return name, (float(low), float(high))
+
+
+def grid_points(grid):
+    """Every combination of {name: [values]}"""
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*grid.values())]
+
+
+def random_points(ranges, samples, seed=0):
+    """samples points drawn uniformly from {name: (low, high)}, the same ones for the same seed"""
+    rng = random.Random(seed)
+    return [
+        {name: rng.uniform(low, high) for name, (low, high) in ranges.items()}
+        for _ in range(samples)
+    ]
+
+
+def set_parameters(params):
+    """Sets the Project globals for one point and reapplies the balance factors to the weights"""
+    for name, value in params.items():
+        setattr(Project, name, value)
+    Project.set_weights(
+        same_finger=Project.same_finger_penalty, same_hand=Project.same_hand_penalty
+    )
+
+
+# Everything about a job that changes its result, a resumed sweep only skips points
+# whose key matches all of them so a results file run with other settings isn't reused
+KEY_FIELDS = (
+    "params",
+    "seed",
+    "start",
+    "corpus",
+    "heatmap",
+    "evaluations",
+    "polish",
+    "allow_shift_layer_swaps",
+)
+
+
+def point_key(job):
+    """What identifies a point in the results file, a resumed sweep skips keys already there"""
+    return json.dumps({field: job[field] for field in KEY_FIELDS}, sort_keys=True)
+
+
+def components(layout, heatmap):
+    """Score breakdown of a layout under the current Project weights"""
+    result = BatchScorer(
+        worker_stats(),
+        [layout.to_json()],
+        home_row_weight=Project.home_row_weight,
+        finger_weight=Project.finger_weight,
+        bigram_weight=Project.bigram_weight,
+        same_finger_penalty=Project.same_finger_penalty,
+        same_hand_penalty=Project.same_hand_penalty,
+        trigram_weight=Project.trigram_weight,
+        skipgram_weight=Project.skipgram_weight,
+        trigram_penalties=Project.trigram_penalties,
+        effort_weight=Project.effort_weight,
+        heatmap=heatmap,
+    ).score()[0]
+    return {component: result[component] for component in COMPONENTS}
+
+
+def run_point(job):
+    """Anneals (and polishes) one point in a worker, job is a dict from sweep()"""
+    started = time.perf_counter()
+    set_parameters(job["params"])
+    heatmap = job["heatmap"]
+    corpus = worker_stats()
+    qwerty_score = make_scorer(KeyboardLayout(STARTING_LAYOUTS["qwerty"], corpus, heatmap)).score
+    layout = KeyboardLayout(STARTING_LAYOUTS.get(job["start"], job["start"]), corpus, heatmap)
+
+    random.seed(job["seed"])  # for anneal(), every point gets the same one
+    schedule = None
+    if job["evaluations"]:
+        schedule = BudgetSchedule(evaluations=job["evaluations"])
+    best_layout, _, _, _, _ = anneal(
+        Project.temperature,
+        Project.cooling_rate,
+        layout,
+        job["allow_shift_layer_swaps"],
+        show_progress=False,
+        schedule=schedule,
+    )
+    scorer = make_scorer(best_layout, batch=job["polish"])
+    if job["polish"]:
+        polish(scorer, MoveGenerator(best_layout, job["allow_shift_layer_swaps"]))
+    return {
+        "key": point_key(job),
+        "point": job["point"],
+        "params": job["params"],
+        "seed": job["seed"],
+        "start": job["start"],
+        "score": scorer.score,
+        "qwerty_score": qwerty_score,
+        "improvement": (qwerty_score - scorer.score) / qwerty_score * 100,
+        "components": components(best_layout, heatmap),
+        "seconds": time.perf_counter() - started,
+        "layout": best_layout.to_json(),
+    }
+
+
+def read_results(path):
+    """Results already in a (possibly half written) results file"""
+    results = []
+    if not os.path.exists(path):
+        return results
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                results.append(json.loads(line))
+            except ValueError:
+                pass  # the line being written when the sweep was stopped
+    return results
+
+
+def drop_partial_line(path):
+    """Cuts off a line that was being written when the sweep was stopped, so new results
+    don't get appended onto the end of it"""
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as f:
+        data = f.read()
+        if data and not data.endswith(b"\n"):
+            f.truncate(data.rfind(b"\n") + 1)
+
+
+def sweep(
+    corpus,
+    points,
+    results_path,
+    seed=400,
+    start="dvorak",
+    evaluations=None,
+    allow_shift_layer_swaps=True,
+    polish_layouts=True,
+    heatmap=None,
+    workers=None,
+    corpus_name=None,
+):
+    """Runs the optimizer once per point (a dict of PARAMETERS) across a process pool.
+    The corpus stats go into shared memory once for every worker. Each result is appended
+    to results_path (one json object per line) as soon as it's done, and points already in
+    the file are skipped, so running the same sweep again carries on where it stopped.
+    Every point uses the same seed so the parameters are all that changes between them.
+    corpus_name (the corpus path) only goes into the keys, so results from another
+    corpus aren't taken for this one's.
+    Returns the results for these points, the ones already in the file first.
+    """
+    jobs = [
+        {
+            "point": i,
+            "params": params,
+            "seed": seed,
+            "start": start,
+            "evaluations": evaluations,
+            "allow_shift_layer_swaps": allow_shift_layer_swaps,
+            "polish": polish_layouts,
+            "heatmap": heatmap,
+            "corpus": corpus_name,
+        }
+        for i, params in enumerate(points)
+    ]
+    results = read_results(results_path)
+    keys = {point_key(job) for job in jobs}
+    others = [result for result in results if result["key"] not in keys]
+    if others:
+        print(f"Ignoring {len(others)} results in {results_path} run with other settings")
+        results = [result for result in results if result["key"] in keys]
+    done = {result["key"] for result in results}
+    jobs = [job for job in jobs if point_key(job) not in done]
+    if done:
+        print(f"Resuming, {len(done)} points done and {len(jobs)} to go")
+    if not jobs:
+        return results
+
+    drop_partial_line(results_path)
+    shared = share_stats(corpus)
+    try:
+        with Pool(workers, initializer=init_worker, initargs=(shared.name,)) as pool, open(
+            results_path, "a", encoding="utf-8"
+        ) as f:
+            for result in pool.imap_unordered(run_point, jobs):
+                f.write(json.dumps(result, ensure_ascii=False) + "\n")
+                f.flush()
+                results.append(result)
+                params = " ".join(f"{name}={value:g}" for name, value in result["params"].items())
+                print(
+                    f"Point {result['point']} | {params} | Improvement over qwerty "
+                    f"{result['improvement']:.2f}% | {result['seconds']:.1f}s"
+                )
+    finally:
+        shared.close()
+        shared.unlink()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Sweep the balance factors and penalties, one optimizer run per point across a process pool"
+    )
+    parser.add_argument(
+        "--grid",
+        nargs="+",
+        default=[],
+        metavar="NAME=V1,V2",
+        help=f"values to try, every combination is run. NAME is one of {', '.join(PARAMETERS)}",
+    )
+    parser.add_argument(
+        "--range",
+        nargs="+",
+        default=[],
+        metavar="NAME=LOW:HIGH",
+        help="sample --samples points uniformly from these ranges instead",
+    )
+    parser.add_argument("--samples", type=int, default=20)
+    parser.add_argument("--sample-seed", type=int, default=0, help="which random points are drawn")
+    parser.add_argument("--corpus", default=Project.corpus_file)
+    parser.add_argument("--heatmap", default=Project.heatmap_file)
+    parser.add_argument("--start", default="dvorak")
+    parser.add_argument("--seed", type=int, default=400)
+    parser.add_argument(
+        "--evaluations", type=int, default=None, help="iterations per point, the default schedule otherwise"
+    )
+    parser.add_argument("--no-shift-swaps", action="store_true")
+    parser.add_argument("--no-polish", action="store_true")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--results", default="sweep.jsonl")
+    parser.add_argument("--top", type=int, default=5, help="how many of the best points to print")
+    args = parser.parse_args()
+
+    if args.range:
+        points = random_points(
+            dict(parse_range(spec) for spec in args.range), args.samples, args.sample_seed
+        )
+    elif args.grid:
+        points = grid_points(dict(parse_values(spec) for spec in args.grid))
+    else:
+        parser.error("give a --grid or a --range to sweep")
+
+    corpus = load_corpus_stats(args.corpus)
+    results = sweep(
+        corpus,
+        points,
+        args.results,
+        seed=args.seed,
+        start=args.start,
+        evaluations=args.evaluations,
+        allow_shift_layer_swaps=not args.no_shift_swaps,
+        polish_layouts=not args.no_polish,
+        heatmap=args.heatmap,
+        workers=args.workers,
+        corpus_name=args.corpus,
+    )
+    print(f"{len(results)} points in {args.results}, best by improvement over qwerty:")
+    for result in sorted(results, key=lambda result: -result["improvement"])[: args.top]:
+        params = " ".join(f"{name}={value:g}" for name, value in result["params"].items())
+        print(f"    {result['improvement']:.2f}% | {params}")
@@ -0,0 +1,188 @@
+import csv
+import json
+import time
+
+# What every recorded point holds, also the CSV header
+FIELDS = (
+    "iteration",
+    "min_score",
+    "max_score",
+    "score",
+    "temperature",
+    "acceptance_rate",
+    "evaluations_per_sec",
+)
+
+
+class ScoreHistory:
+    """Score history of an annealing run in at most max_points points, however long it runs.
+
+    Every point covers bucket_size iterations and keeps the lowest and highest score seen in
+    them (so spikes survive the downsampling), the score at its end, the temperature, the
+    acceptance rate and evaluations/sec. Once max_points are used neighbouring points are
+    merged in pairs and bucket_size doubles, so memory stays flat.
+
+    stream is an optional .csv or .jsonl path every point is also written to as it's made.
+    """
+
+    def __init__(self, max_points=2000, bucket_size=100, stream=None):
+        self.max_points = max_points
+        self.bucket_size = bucket_size
+        self.stream = stream
+        self.points = []  # tuples in FIELDS order
+        self.iteration = 0
+        self.accepted = 0  # accepted moves over the whole run
+        self._stream_file = None
+        self._writer = None
+        self._append = False
+        self._start_bucket()
+
+    def _start_bucket(self):
+        self.in_bucket = 0
+        self.bucket_accepted = 0
+        self.low = float("inf")
+        self.high = float("-inf")
+        self.bucket_started = time.perf_counter()
+
+    def record(self, score, temperature, accepted):
+        """Called once per iteration with the current score"""
+        self.iteration += 1
+        self.in_bucket += 1
+        if accepted:
+            self.accepted += 1
+            self.bucket_accepted += 1
+        if score < self.low:
+            self.low = score
+        if score > self.high:
+            self.high = score
+        if self.in_bucket >= self.bucket_size:
+            self._close_bucket(score, temperature)
+
+    def _close_bucket(self, score, temperature):
+        elapsed = time.perf_counter() - self.bucket_started
+        point = (
+            self.iteration,
+            self.low,
+            self.high,
+            score,
+            temperature,
+            self.bucket_accepted / self.in_bucket,
+            self.in_bucket / elapsed if elapsed > 0 else 0.0,
+        )
+        self.points.append(point)
+        if self.stream:
+            self._write(point)
+        if len(self.points) >= self.max_points:
+            self._merge()
+        self._start_bucket()
+
+    def _merge(self):
+        """Halves the number of points, each pair becomes one covering both"""
+        merged = []
+        for i in range(0, len(self.points) - 1, 2):
+            first, second = self.points[i], self.points[i + 1]
+            merged.append(
+                (
+                    second[0],
+                    min(first[1], second[1]),
+                    max(first[2], second[2]),
+                    second[3],
+                    second[4],
+                    (first[5] + second[5]) / 2,
+                    (first[6] + second[6]) / 2,
+                )
+            )
+        if len(self.points) % 2:
+            merged.append(self.points[-1])
+        self.points = merged
+        self.bucket_size *= 2
+
+    def _write(self, point):
+        if self._stream_file is None:
+            self._stream_file = open(self.stream, "a" if self._append else "w", newline="")
+            if self.stream.endswith(".csv"):
+                self._writer = csv.writer(self._stream_file)
+                if not self._append:
+                    self._writer.writerow(FIELDS)
+        if self._writer is not None:
+            self._writer.writerow(point)
+        else:
+            self._stream_file.write(json.dumps(dict(zip(FIELDS, point))) + "\n")
+
+    def finish(self, score, temperature):
+        """Records whatever's left in the last bucket and closes the stream"""
+        if self.in_bucket:
+            self._close_bucket(score, temperature)
+        if self._stream_file is not None:
+            self._stream_file.close()
+            self._stream_file = None
+            self._writer = None
+
+    def series(self, field):
+        """One column of the points, e.g. series("score")"""
+        index = FIELDS.index(field)
+        return [point[index] for point in self.points]
+
+    def __len__(self):
+        return len(self.points)
+
+    def to_json(self):
+        return {
+            # A copy, the checkpoint is written on another thread while points keep coming
+            "points": list(self.points),
+            "bucket_size": self.bucket_size,
+            "iteration": self.iteration,
+            "accepted": self.accepted,
+            "in_bucket": self.in_bucket,
+            "bucket_accepted": self.bucket_accepted,
+            "low": self.low,
+            "high": self.high,
+        }
+
+    def restore(self, state):
+        """Picks up from to_json(), a stream is appended to rather than started over (once
+        whatever was written after the checkpoint is cut off, see _truncate_stream)"""
+        self.points = [tuple(point) for point in state["points"]]
+        self.bucket_size = state["bucket_size"]
+        self.iteration = state["iteration"]
+        self.accepted = state["accepted"]
+        self._start_bucket()
+        self.in_bucket = state["in_bucket"]
+        self.bucket_accepted = state["bucket_accepted"]
+        self.low = state["low"]
+        self.high = state["high"]
+        self._append = True
+        if self.stream:
+            self._truncate_stream(self.iteration)
+        return self
+
+    def _truncate_stream(self, iteration):
+        """Drops points the stream got after the checkpoint was taken (and a line that was
+        being written when the run was stopped), the resumed run writes them again"""
+        try:
+            with open(self.stream, "r", newline="") as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            self._append = False
+            return
+        kept = []
+        for line in lines:
+            if not line.endswith("\n"):
+                break
+            try:
+                if self.stream.endswith(".csv"):
+                    row = next(csv.reader([line]))
+                    if row and row[0] == FIELDS[0]:
+                        kept.append(line)  # the header
+                        continue
+                    point_iteration = int(row[0])
+                else:
+                    point_iteration = json.loads(line)["iteration"]
+            except (ValueError, KeyError, IndexError, StopIteration):
+                break
+            if point_iteration > iteration:
+                break
+            kept.append(line)
+        with open(self.stream, "w", newline="") as f:
+            f.writelines(kept)
+        self._append = bool(kept)
@@ -0,0 +1,80 @@
+import os
+
+import stats_store
+from corpus_stats import count_directory
+from stats_store import StatsStore, refresh_store
+
+
+def write(path, text):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+
+def make_corpus(directory):
+    os.makedirs(directory)
+    write(os.path.join(directory, "a.java"), "public class A {}\n")
+    write(os.path.join(directory, "b.java"), "int b = 1;\n")
+    write(os.path.join(directory, "c.java"), "return c;\n")
+
+
+def change_corpus(directory):
+    write(os.path.join(directory, "b.java"), "int b = 12345678901234567890;\n")
+    os.remove(os.path.join(directory, "c.java"))
+    write(os.path.join(directory, "d.java"), "d++;\n")
+
+
+def assert_matches(stats, directory):
+    expected = count_directory(directory, workers=1, count_trigrams=True)
+    assert dict(stats.frequencies) == dict(expected.frequencies)
+    assert dict(stats.bigrams) == dict(expected.bigrams)
+    assert dict(stats.trigrams) == dict(expected.trigrams)
+
+
+def test_refresh_counts_only_changes(tmp_path):
+    corpus, store = str(tmp_path / "corpus"), str(tmp_path / "store")
+    make_corpus(corpus)
+    assert_matches(refresh_store(corpus, store, workers=1, count_trigrams=True), corpus)
+    change_corpus(corpus)
+    assert_matches(refresh_store(corpus, store, workers=1, count_trigrams=True), corpus)
+
+
+def test_interrupted_refresh(tmp_path):
+    corpus, store = str(tmp_path / "corpus"), str(tmp_path / "store")
+    make_corpus(corpus)
+    refresh_store(corpus, store, workers=1, count_trigrams=True)
+    change_corpus(corpus)
+    # Everything a refresh writes before save(), then the run dies
+    StatsStore(store, True).refresh(corpus, workers=1)
+    assert_matches(refresh_store(corpus, store, workers=1, count_trigrams=True), corpus)
+    # Only the counts the saved manifest points at are left
+    used = {entry["stats"] for entry in StatsStore(store, True).files.values()}
+    assert {f"files/{name}" for name in os.listdir(os.path.join(store, "files"))} == used
+
+
+def test_missing_file_stats_recounts(tmp_path):
+    corpus, store = str(tmp_path / "corpus"), str(tmp_path / "store")
+    make_corpus(corpus)
+    refresh_store(corpus, store, workers=1, count_trigrams=True)
+    for name in os.listdir(os.path.join(store, "files")):
+        os.remove(os.path.join(store, "files", name))
+    change_corpus(corpus)
+    assert_matches(refresh_store(corpus, store, workers=1, count_trigrams=True), corpus)
+
+
+def test_recount_keeps_workers(tmp_path, monkeypatch):
+    corpus, store = str(tmp_path / "corpus"), str(tmp_path / "store")
+    make_corpus(corpus)
+    refresh_store(corpus, store, workers=1, count_trigrams=True)
+    for name in os.listdir(os.path.join(store, "files")):
+        os.remove(os.path.join(store, "files", name))
+    change_corpus(corpus)
+    workers = []
+    count_files = stats_store.count_files
+
+    def recording_count_files(paths, workers_given=None, **options):
+        workers.append(workers_given)
+        return count_files(paths, 1, **options)
+
+    monkeypatch.setattr(stats_store, "count_files", recording_count_files)
+    StatsStore(store, True).refresh(corpus, workers=3)
+    assert workers and set(workers) == {3}
@@ -0,0 +1,266 @@
+import numpy as np
+from Key import Key
+from incremental_scorer import moved_by_cycle_keys, moved_by_swap_keys, moved_by_swap_shifts
+from ngram_scoring import FINGER_COUNT, finger_id, trigram_cost_table
+
+
+def penalty_matrix(fingers, hands, same_finger_penalty, same_hand_penalty):
+    """slots x slots same finger/same hand penalties, from each slot's finger and hand
+    (see KeyboardLayout.slot_tables). A slot without a finger is never penalized."""
+    penalties = np.zeros((len(fingers), len(fingers)), dtype=np.float64)
+    for i, finger1 in enumerate(fingers):
+        for j, finger2 in enumerate(fingers):
+            if finger1 and finger2:
+                if finger1 == finger2:
+                    penalties[i, j] = same_finger_penalty
+                elif hands[i] == hands[j]:
+                    penalties[i, j] = same_hand_penalty
+    return penalties
+
+
+class VectorizedScorer:
+    """NumPy version of IncrementalScorer, same interface and same scores.
+    Everything that only depends on the physical keyboard is turned into arrays once:
+        - position_costs[slot]: Key.score() for a key sitting in that slot
+        - penalties[slot, slot]: same finger/same hand penalty between 2 slots
+        - frequencies[char]: how often each character is typed as a key's base
+        - bigrams[char, char]: bigram counts from the corpus (plus weighted skipgrams)
+        - trigrams: sparse, 3 arrays of character ids and their counts, scored through
+          trigram_costs indexed by the 3 slots' finger ids
+    A layout is then just char_slots, an array of which slot every character sits in.
+    """
+
+    def __init__(
+        self,
+        layout,
+        home_row_weight=1,
+        finger_weight=1,
+        bigram_weight=1,
+        same_finger_penalty=3.0,
+        same_hand_penalty=1.5,
+        trigram_weight=0,
+        skipgram_weight=0,
+        trigram_penalties=None,
+        effort_weight=1,
+    ):
+        self.layout = layout
+        self.bigram_weight = bigram_weight
+        self.trigram_weight = trigram_weight
+
+        self.slots = list(layout.layout)
+        self.slot_index = {loc: i for i, loc in enumerate(self.slots)}
+        costs = layout.position_costs(home_row_weight, finger_weight, effort_weight)
+        self.position_costs = np.array([costs[loc] for loc in self.slots], dtype=np.float64)
+        fingers = [layout.slot_fingers[loc] for loc in self.slots]
+        hands = [layout.slot_hands[loc] for loc in self.slots]
+        self.penalties = penalty_matrix(fingers, hands, same_finger_penalty, same_hand_penalty)
+
+        self.chars = list(layout.char_locations)
+        self.char_ids = {char: i for i, char in enumerate(self.chars)}
+        self.frequencies = np.zeros(len(self.chars), dtype=np.float64)
+        for key in layout.layout.values():
+            if key.frequency > 0 and layout.char_locations.get(key.base) == key.location:
+                self.frequencies[self.char_ids[key.base]] = key.frequency
+        self.bigrams = self.pair_matrix(layout.bigrams)
+        if skipgram_weight:
+            # Skipgrams take the same penalties as bigrams, so they fold into the same matrix
+            self.bigrams = (
+                bigram_weight * self.bigrams + skipgram_weight * self.pair_matrix(layout.skipgrams)
+            )
+            self.bigram_weight = 1
+
+        self.finger_ids = np.array([finger_id(finger) for finger in fingers], dtype=np.intp)
+        self.trigram_costs = np.array(trigram_cost_table(trigram_penalties), dtype=np.float64)
+        trigrams = []
+        if trigram_weight:
+            trigrams = [
+                ([self.char_ids[char] for char in trigram], freq)
+                for trigram, freq in layout.trigrams.items()
+                if all(char in self.char_ids for char in trigram)
+            ]
+        self.trigram_chars = np.array(
+            [ids for ids, _ in trigrams], dtype=np.intp
+        ).reshape(-1, 3)
+        self.trigram_counts = np.array([freq for _, freq in trigrams], dtype=np.float64)
+        # character id -> the rows of trigram_chars it appears in
+        rows_by_char = [[] for _ in self.chars]
+        for row, (ids, _) in enumerate(trigrams):
+            for char_id in set(ids):
+                rows_by_char[char_id].append(row)
+        self.trigrams_by_char = [np.array(rows, dtype=np.intp) for rows in rows_by_char]
+
+        self.char_slots = self.permutation()
+        self.score = self.score_permutation(self.char_slots)
+
+    def pair_matrix(self, pairs):
+        """Dense char x char counts of a bigram style Counter"""
+        matrix = np.zeros((len(self.chars), len(self.chars)), dtype=np.float64)
+        for (char1, char2), freq in pairs.items():
+            if char1 in self.char_ids and char2 in self.char_ids:
+                matrix[self.char_ids[char1], self.char_ids[char2]] += freq
+        return matrix
+
+    def trigram_score(self, char_slots, rows=slice(None)):
+        """Unweighted cost of the given trigram rows with characters in char_slots"""
+        fingers = self.finger_ids[char_slots[self.trigram_chars[rows]]]
+        index = (fingers[:, 0] * FINGER_COUNT + fingers[:, 1]) * FINGER_COUNT + fingers[:, 2]
+        return self.trigram_counts[rows] @ self.trigram_costs[index]
+
+    def permutation(self):
+        """Current layout as an array of slot indices, one per character"""
+        return np.array(
+            [self.slot_index[self.layout.char_locations[char]] for char in self.chars],
+            dtype=np.intp,
+        )
+
+    def score_permutation(self, char_slots):
+        """Full score of a layout given as a char_slots array, a gather and a couple of dot products"""
+        key_score = self.frequencies @ self.position_costs[char_slots]
+        bigram_score = np.sum(
+            self.bigrams * self.penalties[np.ix_(char_slots, char_slots)]
+        )
+        score = key_score + self.bigram_weight * bigram_score
+        if self.trigram_weight:
+            score += self.trigram_weight * self.trigram_score(char_slots)
+        return float(score)
+
+    def _delta(self, moved):
+        """Score change and new char_slots if the characters in moved were relocated
+        Only the bigram rows and columns of the moved characters are looked at
+        """
+        if not moved:
+            return 0.0, self.char_slots
+        ids = np.array([self.char_ids[char] for char in moved], dtype=np.intp)
+        old = self.char_slots
+        new = old.copy()
+        new[ids] = [self.slot_index[loc] for loc in moved.values()]
+        old_ids = old[ids]
+        new_ids = new[ids]
+
+        penalties = self.penalties
+        bigrams = self.bigrams
+        rows = np.sum(
+            bigrams[ids]
+            * (penalties[np.ix_(new_ids, new)] - penalties[np.ix_(old_ids, old)])
+        )
+        columns = np.sum(
+            bigrams[:, ids]
+            * (penalties[np.ix_(new, new_ids)] - penalties[np.ix_(old, old_ids)])
+        )
+        # Bigrams made of 2 moved characters were counted by both rows and columns
+        overlap = np.sum(
+            bigrams[np.ix_(ids, ids)]
+            * (
+                penalties[np.ix_(new_ids, new_ids)]
+                - penalties[np.ix_(old_ids, old_ids)]
+            )
+        )
+        key_delta = self.frequencies[ids] @ (
+            self.position_costs[new_ids] - self.position_costs[old_ids]
+        )
+        delta = key_delta + self.bigram_weight * (rows + columns - overlap)
+        if self.trigram_weight:
+            delta += self.trigram_weight * self.trigram_delta(ids, old, new)
+        return float(delta), new
+
+    def trigram_delta(self, ids, old, new):
+        """Unweighted trigram score change over the trigrams touching the characters in ids"""
+        touched = np.unique(np.concatenate([self.trigrams_by_char[i] for i in ids]))
+        return self.trigram_score(new, touched) - self.trigram_score(old, touched)
+
+    def batch_delta(self, moves):
+        """Score changes of many moves at once, each a dict of character -> new location
+        like _delta takes, nothing is applied.
+        With R[c, t] the penalty of every bigram starting with c if c sat in slot t (and the
+        rest where they are) and C[c, t] the same for bigrams ending with c, a move's bigram
+        change is R[c, new] - R[c, old] + C[c, new] - C[c, old] over its moved characters,
+        corrected for the bigrams between 2 moved characters. R and C are 2 matrix products
+        for the whole batch, so scanning a neighbourhood costs about one full score.
+        Trigrams (if weighted) are still looked at move by move.
+        """
+        width = max((len(moved) for moved in moves), default=0)
+        ids = np.zeros((len(moves), width), dtype=np.intp)
+        new = np.zeros((len(moves), width), dtype=np.intp)
+        mask = np.zeros((len(moves), width), dtype=np.float64)
+        for row, moved in enumerate(moves):
+            ids[row, : len(moved)] = [self.char_ids[char] for char in moved]
+            new[row, : len(moved)] = [self.slot_index[loc] for loc in moved.values()]
+            mask[row, : len(moved)] = 1
+        char_slots = self.char_slots
+        old = np.where(mask > 0, char_slots[ids], new)
+
+        penalties = self.penalties
+        bigrams = self.bigrams
+        outgoing = bigrams @ penalties[:, char_slots].T
+        incoming = bigrams.T @ penalties[char_slots, :]
+        single = (
+            outgoing[ids, new] - outgoing[ids, old] + incoming[ids, new] - incoming[ids, old]
+        )
+        between = bigrams[ids[:, :, None], ids[:, None, :]] * (
+            penalties[new[:, :, None], new[:, None, :]]
+            - penalties[new[:, :, None], old[:, None, :]]
+            - penalties[old[:, :, None], new[:, None, :]]
+            + penalties[old[:, :, None], old[:, None, :]]
+        )
+        bigram_delta = np.sum(single * mask, axis=1) + np.einsum(
+            "sij,si,sj->s", between, mask, mask
+        )
+        key_delta = np.sum(
+            self.frequencies[ids] * (self.position_costs[new] - self.position_costs[old]) * mask,
+            axis=1,
+        )
+        deltas = key_delta + self.bigram_weight * bigram_delta
+        if self.trigram_weight:
+            for row, moved in enumerate(moves):
+                if moved:
+                    count = len(moved)
+                    moved_slots = char_slots.copy()
+                    moved_slots[ids[row, :count]] = new[row, :count]
+                    deltas[row] += self.trigram_weight * self.trigram_delta(
+                        ids[row, :count], char_slots, moved_slots
+                    )
+        return deltas
+
+    def delta_swap_keys(self, key1: Key, key2: Key):
+        """Score change if swap_keys(key1, key2) were applied, doesn't touch the layout"""
+        moved = moved_by_swap_keys(self.layout.char_locations, key1, key2)
+        if moved is None:
+            return 0
+        return self._delta(moved)[0]
+
+    def delta_swap_shifts(self, key1: Key, key2: Key):
+        """Score change if swap_shifts(key1, key2) were applied, doesn't touch the layout"""
+        moved = moved_by_swap_shifts(self.layout.char_locations, key1, key2)
+        if moved is None:
+            return 0
+        return self._delta(moved)[0]
+
+    def delta_cycle_keys(self, key1: Key, key2: Key, key3: Key):
+        """Score change if the 3 keys were cycled (see moved_by_cycle_keys), doesn't touch the layout"""
+        moved = moved_by_cycle_keys(self.layout.char_locations, key1, key2, key3)
+        if moved is None:
+            return 0
+        return self._delta(moved)[0]
+
+    def apply_cycle_keys(self, key1: Key, key2: Key, key3: Key):
+        """Cycles the 3 keys, as 2 swaps"""
+        self.apply_swap_keys(key1, key2)
+        self.apply_swap_keys(key2, key3)
+
+    def apply_swap_keys(self, key1: Key, key2: Key):
+        """Swaps the keys in the layout and updates char_slots"""
+        moved = moved_by_swap_keys(self.layout.char_locations, key1, key2)
+        if moved is None:
+            return
+        delta, self.char_slots = self._delta(moved)
+        self.layout.swap_keys(key1, key2)
+        self.score += delta
+
+    def apply_swap_shifts(self, key1: Key, key2: Key):
+        """Swaps the shift layer in the layout and updates char_slots"""
+        moved = moved_by_swap_shifts(self.layout.char_locations, key1, key2)
+        if moved is None:
+            return
+        delta, self.char_slots = self._delta(moved)
+        self.layout.swap_shifts(key1, key2)
+        self.score += delta